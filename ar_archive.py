@@ -0,0 +1,49 @@
+from collections import namedtuple
+
+ArchiveMember = namedtuple('ArchiveMember', 'name data')
+
+AR_MAGIC = b'!<arch>\n'
+AR_HEADER_SIZE = 60
+AR_SYMBOL_TABLES = ['/', '/SYM64/', '__.SYMDEF', '__.SYMDEF SORTED']
+
+
+def read_archive_members(filename):
+    # Returns the object members of a GNU or BSD ar archive, or None if the
+    # file is not a regular (non-thin) archive.
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(AR_MAGIC):
+        return None
+
+    members = []
+    long_names = b''
+    pos = len(AR_MAGIC)
+    while pos + AR_HEADER_SIZE <= len(data):
+        header = data[pos:pos + AR_HEADER_SIZE]
+        name = header[0:16].decode('utf-8', 'replace').rstrip()
+        size = int(header[48:58])
+        pos += AR_HEADER_SIZE
+        body = data[pos:pos + size]
+        # Members are 2-byte aligned.
+        pos += size + (size & 1)
+
+        if name == '//':
+            long_names = body
+            continue
+        if name in AR_SYMBOL_TABLES:
+            continue
+
+        if name.startswith('#1/'):
+            # BSD: the name follows the header.
+            length = int(name[3:])
+            name = body[:length].rstrip(b'\0').decode('utf-8', 'replace')
+            body = body[length:]
+        elif name.startswith('/') and name[1:].isdigit():
+            # GNU: offset into the long name table.
+            offset = int(name[1:])
+            end = long_names.find(b'/\n', offset)
+            name = long_names[offset:end].decode('utf-8', 'replace')
+        elif name.endswith('/'):
+            name = name[:-1]
+        members.append(ArchiveMember(name=name, data=body))
+    return members
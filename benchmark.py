@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# Copyright (c) Open Enclave SDK contributors.
+# Licensed under the MIT License.
+
+from concurrent.futures import ProcessPoolExecutor
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import stats
+import trace
+from callgraph import print_callstacks
+from elf_parser_factory import BACKENDS
+from walker import LineWriter
+
+# Times the analysis phases on generated workloads, to catch performance
+# regressions. Workloads are built from a random call graph of a given
+# number of functions, each calling fanout others:
+#
+#   listing:<backend>  objdump or llvm-objdump output for the graph, parsed
+#                      without running the tool
+#   map                a linker map with a cross reference table, and the
+#                      objdump -d -r listings of its objects and archives
+#   elf:<backend>      the graph compiled into a small program with cc
+#   trace              the linker map of that program
+#
+# The phases are those of stats.py; walk prints the callers of the most
+# called function.
+#
+# Every run of a workload is a fresh process, so the peak resident set
+# size reported is that of the workload alone; the tools it ran are
+# reported separately. With several runs the fastest time of each phase
+# is kept. Results can be saved and later compared against:
+#
+#   ./benchmark.py --save baseline.json
+#   ./benchmark.py --baseline baseline.json
+
+RESULTS_VERSION = 1
+TEXT_BASE = 0x401000
+# Instructions of each function besides its calls, as 3 byte movs.
+FILLER = 8
+# Differences smaller than these are noise, whatever the tolerance.
+MIN_SECONDS = 0.01
+MIN_RSS_KB = 1024
+# Layout of the compiled program: objects, archives and members of each.
+PROGRAM_FILES = (4, 2, 4)
+
+
+def function_name(i):
+    return 'fn%d' % i
+
+
+def random_call_graph(functions, fanout, seed):
+    # callees[i] lists the functions called by function i.
+    rng = random.Random(seed)
+    count = min(fanout, functions - 1)
+    callees = []
+    for i in range(functions):
+        callees.append([j for j in rng.sample(range(functions), count + 1) if j != i][:count])
+    return callees
+
+
+def function_addresses(callees):
+    addresses = []
+    address = TEXT_BASE
+    for calls in callees:
+        addresses.append(address)
+        address += 3 * FILLER + 5 * len(calls) + 1
+    return addresses
+
+
+def rel32_bytes(value):
+    return ' '.join('%02x' % b for b in (value & 0xffffffff).to_bytes(4, 'little'))
+
+
+def objdump_listing(callees):
+    # Output of objdump -C -d.
+    addresses = function_addresses(callees)
+    lines = ['', 'synthetic:     file format elf64-x86-64', '', '',
+             'Disassembly of section .text:', '']
+    for (i, calls) in enumerate(callees):
+        pc = addresses[i]
+        lines.append('%016x <%s>:' % (pc, function_name(i)))
+        for k in range(FILLER):
+            lines.append('  %x:\t48 89 e5             \tmov    %%rsp,%%rbp' % pc)
+            pc += 3
+        for j in calls:
+            target = addresses[j]
+            lines.append('  %x:\te8 %s       \tcallq  %x <%s>'
+                         % (pc, rel32_bytes(target - pc - 5), target, function_name(j)))
+            pc += 5
+        lines.append('  %x:\tc3                   \tretq   ' % pc)
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def llvm_objdump_outputs(callees):
+    # Outputs of llvm-objdump -t and llvm-objdump -d.
+    addresses = function_addresses(callees)
+    symbols = ['', 'synthetic:\tfile format ELF64-x86-64', '', 'SYMBOL TABLE:']
+    lines = ['', 'synthetic:\tfile format ELF64-x86-64', '', '',
+             'Disassembly of section .text:']
+    for (i, calls) in enumerate(callees):
+        pc = addresses[i]
+        size = 3 * FILLER + 5 * len(calls) + 1
+        symbols.append('%016x g     F .text\t%016x %s' % (pc, size, function_name(i)))
+        lines.append('%s:' % function_name(i))
+        for k in range(FILLER):
+            lines.append('  %x:\t48 89 e5\tmovq\t%%rsp, %%rbp' % pc)
+            pc += 3
+        for j in calls:
+            rel = addresses[j] - pc - 5
+            lines.append('  %x:\te8 %s\tcallq\t%d <%s>'
+                         % (pc, rel32_bytes(rel), rel, function_name(j)))
+            pc += 5
+        lines.append('  %x:\tc3\tretq' % pc)
+        lines.append('')
+    return {'symbols': '\n'.join(symbols) + '\n', 'listing': '\n'.join(lines) + '\n'}
+
+
+def file_layout(functions, objects, archives, members):
+    # Names of the input files, and the file each function is defined in.
+    files = ['obj%d.o' % k for k in range(objects)]
+    for a in range(archives):
+        files.extend('lib%d.a(m%d.o)' % (a, m) for m in range(members))
+    return (files, [files[i % len(files)] for i in range(functions)])
+
+
+def object_listing(functions):
+    # objdump -d -r output for the (index, callees) pairs of one object.
+    lines = []
+    for (i, calls) in functions:
+        pc = 0
+        lines.append('%016x <%s>:' % (pc, function_name(i)))
+        for k in range(FILLER):
+            lines.append('  %3x:\t48 89 e5             \tmov    %%rsp,%%rbp' % pc)
+            pc += 3
+        for j in calls:
+            lines.append('  %3x:\te8 00 00 00 00       \tcall   %x <%s+0x%x>'
+                         % (pc, pc + 5, function_name(i), pc + 5))
+            lines.append('\t\t\t%x: R_X86_64_PLT32\t%s-0x4' % (pc + 1, function_name(j)))
+            pc += 5
+        lines.append('  %3x:\tc3                   \tret' % pc)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def linker_map(callees, objects, archives, members):
+    # Returns the map text and the objdump -d -r listing of every loaded
+    # file.
+    (files, defined_in) = file_layout(len(callees), objects, archives, members)
+    by_file = dict((f, []) for f in files)
+    for (i, calls) in enumerate(callees):
+        by_file[defined_in[i]].append((i, calls))
+
+    listings = {}
+    for k in range(objects):
+        name = 'obj%d.o' % k
+        listings[name] = ('\n%s:     file format elf64-x86-64\n\n\n'
+                          'Disassembly of section .text:\n\n' % name
+                          + object_listing(by_file[name]))
+    for a in range(archives):
+        parts = ['\nIn archive lib%d.a:\n' % a]
+        for m in range(members):
+            parts.append('\nm%d.o:     file format elf64-x86-64\n\n\n'
+                         'Disassembly of section .text:\n\n' % m)
+            parts.append(object_listing(by_file['lib%d.a(m%d.o)' % (a, m)]))
+        listings['lib%d.a' % a] = ''.join(parts)
+
+    refs = [[defined_in[i]] for i in range(len(callees))]
+    for (i, calls) in enumerate(callees):
+        for j in calls:
+            if defined_in[i] not in refs[j]:
+                refs[j].append(defined_in[i])
+
+    lines = ['Memory Configuration', '', 'Linker script and memory map', '']
+    lines.extend('LOAD %s' % name for name in listings)
+    lines.extend(['', 'Cross Reference Table', '', '%-50sFile' % 'Symbol'])
+    for i in sorted(range(len(callees)), key=function_name):
+        lines.append('%-50s%s' % (function_name(i), refs[i][0]))
+        lines.extend('%-50s%s' % ('', ref) for ref in refs[i][1:])
+    return ('\n'.join(lines) + '\n', listings)
+
+
+def c_sources(callees, objects, archives, members):
+    # C files of a freestanding program with the call graph, by object file
+    # name.
+    (files, defined_in) = file_layout(len(callees), objects, archives, members)
+    sources = dict((f, ['__attribute__((noinline)) int %s(int x);' % function_name(i)
+                        for i in range(len(callees))]) for f in files)
+    for (i, calls) in enumerate(callees):
+        body = ' + '.join('%s(x - %d)' % (function_name(j), n + 1) for (n, j) in enumerate(calls))
+        sources[defined_in[i]].append('int %s(int x) { return x <= 0 ? x : %s; }'
+                                      % (function_name(i), body or 'x'))
+    sources[files[0]].append('void _start(void) { %s(3); for (;;); }' % function_name(0))
+    return dict((f, '\n'.join(lines) + '\n') for (f, lines) in sources.items())
+
+
+def build_program(directory, callees, objects, archives, members, cc='cc'):
+    # Compiles the program into directory and returns the paths of the
+    # binary and its linker map.
+    object_paths = []
+    archive_members = {}
+    for (name, source) in c_sources(callees, objects, archives, members).items():
+        path = os.path.join(directory, name[:-2] + '.c')
+        if '(' in name:
+            # Members of different archives share names.
+            (archive, member) = name[:-1].split('(')
+            os.makedirs(os.path.join(directory, archive[:-2]), exist_ok=True)
+            path = os.path.join(directory, archive[:-2], member[:-2] + '.c')
+            archive_members.setdefault(archive, []).append(path[:-2] + '.o')
+        else:
+            object_paths.append(path[:-2] + '.o')
+        with open(path, 'w') as f:
+            f.write(source)
+        subprocess.check_call([cc, '-c', '-O1', '-g', '-fno-pic', '-o', path[:-2] + '.o', path])
+    archive_paths = []
+    for (archive, paths) in archive_members.items():
+        path = os.path.join(directory, archive)
+        subprocess.check_call(['ar', 'rcs', path] + paths)
+        archive_paths.append(path)
+
+    binary = os.path.join(directory, 'program')
+    map_file = binary + '.map'
+    # The archives refer to each other, so they are searched as a group.
+    subprocess.check_call([cc, '-nostdlib', '-static', '-no-pie', '-o', binary] +
+                          object_paths + ['-Wl,--start-group'] + archive_paths +
+                          ['-Wl,--end-group'] +
+                          ['-Wl,-Map=%s,--cref' % map_file])
+    return (binary, map_file)
+
+
+def synthetic_parser_class(parser_class, outputs):
+    # A subclass of parser_class that takes tool output from
+    # outputs['symbols'] for symbol tables and outputs['listing'] for
+    # disassembly instead of running the tool.
+    class SyntheticParser(parser_class):
+        def run_tool(self, args):
+            with stats.phase('tool'):
+                return outputs['symbols' if '-t' in args else 'listing']
+
+    return SyntheticParser
+
+
+def run_parser(parser_class, binary_file_name, walk_depth, jobs):
+    if parser_class.tool is None:
+        elf_parser = parser_class(binary_file_name, False)
+    else:
+        elf_parser = parser_class(binary_file_name, False, jobs=jobs)
+    elf_parser.analyze()
+    table = elf_parser.functions_table
+
+    root = max(table.functions(), key=lambda f: len(f.callers), default=None)
+    with open(os.devnull, 'w') as out, stats.phase('walk'):
+        writer = LineWriter(out)
+        if root is not None:
+            print_callstacks(table, root.name, walk_depth, writer, back_references=True)
+        writer.flush()
+    return {'functions': len(table.table), 'edges': table.graph.edge_count}
+
+
+def synthetic_disassembly(listings):
+    @contextlib.contextmanager
+    def disassembly_lines(filename):
+        yield io.StringIO(listings.pop(filename))
+    return disassembly_lines
+
+
+def run_trace(map_lines, disassembly_lines, walk_depth):
+    # The steps of trace.read_linker_map, in one process.
+    (loaded, cref_table) = trace.parse_linker_map(map_lines)
+    object_table = {}
+    for filename in loaded:
+        if not (filename.endswith('.o') or filename.endswith('.a')):
+            continue
+        with stats.phase('tool'), disassembly_lines(filename) as lines:
+            for (name, records) in trace.parse_load(filename, lines):
+                object_table[name] = trace.process_object_listing(name, records)
+    (objects, functions) = trace.link_functions(object_table, cref_table)
+
+    trace.colorize = False
+    lookup = trace.FunctionLookup(objects, functions)
+    root = max(functions.values(), key=lambda f: len(f.callers), default=None)
+    with open(os.devnull, 'w') as out, stats.phase('walk'):
+        writer = LineWriter(out)
+        if root is not None:
+            trace.trace(lookup, root.name, walk_depth, writer, back_references=True)
+        writer.flush()
+    fcns = [f for obj in objects.values() for f in obj.functions]
+    return {'functions': len(fcns), 'edges': sum(len(f.callees) for f in fcns)}
+
+
+def run_workload(workload, params, build):
+    # Runs in a fresh worker process.
+    walk_depth = params['walk_depth']
+    (kind, _, backend) = workload.partition(':')
+    if kind in ('listing', 'map'):
+        callees = random_call_graph(params['functions'], params['fanout'], params['seed'])
+    if kind == 'listing':
+        if backend == 'llvm-objdump':
+            outputs = llvm_objdump_outputs(callees)
+        else:
+            outputs = {'listing': objdump_listing(callees)}
+        del callees
+        parser_class = synthetic_parser_class(BACKENDS[backend], outputs)
+        counts = run_parser(parser_class, 'synthetic', walk_depth, params['jobs'])
+    elif kind == 'map':
+        (map_text, listings) = linker_map(callees, params['objects'], params['archives'],
+                                          params['members'])
+        del callees
+        counts = run_trace(io.StringIO(map_text), synthetic_disassembly(listings), walk_depth)
+    elif kind == 'elf':
+        counts = run_parser(BACKENDS[backend], build['binary'], walk_depth, params['jobs'])
+    else:
+        with open(build['map']) as f, contextlib.redirect_stdout(sys.stderr):
+            counts = run_trace(f, trace.disassembly_lines, walk_depth)
+
+    result = dict(counts)
+    result['phases'] = stats.STATS.phases
+    result['counters'] = stats.STATS.counters
+    result['total'] = sum(stats.STATS.phases.values())
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['tool_peak_rss_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return result
+
+
+def best_of(results):
+    best = dict(results[0])
+    best['phases'] = dict((phase, min(r['phases'][phase] for r in results))
+                          for phase in results[0]['phases'])
+    for key in ['total', 'peak_rss_kb', 'tool_peak_rss_kb']:
+        best[key] = min(r[key] for r in results)
+    return best
+
+
+def run_benchmarks(workloads, params, build, repeat):
+    results = {}
+    for workload in workloads:
+        runs = []
+        for n in range(repeat):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                runs.append(executor.submit(run_workload, workload, params, build).result())
+        results[workload] = best_of(runs)
+        print_result(workload, results[workload])
+    return results
+
+
+def print_result(workload, result):
+    phases = '  '.join('%s %.3fs' % (phase, seconds)
+                       for (phase, seconds) in sorted(result['phases'].items()))
+    print('%-20s %7d functions %8d edges  %.3fs  (%s)  peak RSS %d KB, tools %d KB'
+          % (workload, result['functions'], result['edges'], result['total'], phases,
+             result['peak_rss_kb'], result['tool_peak_rss_kb']))
+
+
+def compare(baseline, results, tolerance):
+    # Prints the changes from baseline and returns the number of
+    # regressions.
+    if baseline.get('parameters') != results['parameters']:
+        print('Warning: the baseline was run with other parameters: %s'
+              % json.dumps(baseline.get('parameters')))
+    regressions = 0
+    print('\n%-20s %-16s %12s %12s %8s' % ('workload', 'measure', 'baseline', 'current', 'change'))
+    for (workload, result) in results['workloads'].items():
+        old = baseline['workloads'].get(workload)
+        if old is None:
+            print('%-20s not in the baseline' % workload)
+            continue
+        measures = [(phase, old['phases'].get(phase), seconds, MIN_SECONDS, '%.3fs')
+                    for (phase, seconds) in sorted(result['phases'].items())]
+        measures.append(('total', old['total'], result['total'], MIN_SECONDS, '%.3fs'))
+        measures.append(('peak_rss_kb', old['peak_rss_kb'], result['peak_rss_kb'],
+                         MIN_RSS_KB, '%d'))
+        for (measure, before, after, floor, fmt) in measures:
+            if before is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            regressed = after > before * (1 + tolerance) and after - before >= floor
+            regressions += regressed
+            print('%-20s %-16s %12s %12s %+7.1f%%%s'
+                  % (workload, measure, fmt % before, fmt % after, change,
+                     '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the analysis phases.')
+    parser.add_argument('-f', '--functions', metavar='', default=20000, type=int,
+                        help='number of functions of the synthetic workloads (default=20000)')
+    parser.add_argument('--fanout', metavar='', default=4, type=int,
+                        help='number of functions called by each function (default=4)')
+    parser.add_argument('--objects', metavar='', default=64, type=int,
+                        help='number of object files of the synthetic linker map (default=64)')
+    parser.add_argument('--archives', metavar='', default=8, type=int,
+                        help='number of archives of the synthetic linker map (default=8)')
+    parser.add_argument('--members', metavar='', default=16, type=int,
+                        help='number of objects in each archive (default=16)')
+    parser.add_argument('--elf-functions', metavar='', default=400, type=int,
+                        help='number of functions of the compiled program (default=400)')
+    parser.add_argument('--seed', metavar='', default=1, type=int,
+                        help='seed of the random call graphs (default=1)')
+    parser.add_argument('-j', '--jobs', metavar='', default=1, type=int,
+                        help='processes parsing disassembly in the listing and elf workloads '
+                             '(default=1)')
+    parser.add_argument('-d', '--depth', metavar='', default=8, type=int,
+                        help='depth of the caller trees walked (default=8)')
+    parser.add_argument('-b', '--backend', metavar='', action='append', choices=list(BACKENDS),
+                        help='backend of the elf workloads; may be repeated '
+                             '(default=objdump and native)')
+    parser.add_argument('-w', '--workload', metavar='', action='append',
+                        help='run only this workload, e.g. listing:objdump, map, elf:native '
+                             'or trace; may be repeated')
+    parser.add_argument('-n', '--repeat', metavar='', default=3, type=int,
+                        help='runs of each workload; the fastest is kept (default=3)')
+    parser.add_argument('--cc', metavar='', default='cc',
+                        help='C compiler for the elf and trace workloads (default=cc)')
+    parser.add_argument('--save', metavar='', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline', metavar='', default=None,
+                        help='compare the results against this JSON file, and exit with '
+                             'status 1 on regressions')
+    parser.add_argument('--tolerance', metavar='', default=0.25, type=float,
+                        help='relative slowdown or growth counted as a regression '
+                             '(default=0.25)')
+    args = parser.parse_args()
+
+    params = {'functions': args.functions, 'fanout': args.fanout, 'objects': args.objects,
+              'archives': args.archives, 'members': args.members,
+              'elf_functions': args.elf_functions, 'seed': args.seed,
+              'walk_depth': args.depth, 'jobs': args.jobs}
+    backends = args.backend or ['objdump', 'native']
+    workloads = args.workload or (['listing:objdump', 'listing:llvm-objdump', 'map'] +
+                                  ['elf:%s' % b for b in backends] + ['trace'])
+    for workload in workloads:
+        (kind, _, backend) = workload.partition(':')
+        valid_backends = BACKENDS if kind == 'elf' else ['objdump', 'llvm-objdump']
+        if kind not in ('listing', 'map', 'elf', 'trace') or \
+           (kind in ('listing', 'elf')) != (backend in valid_backends):
+            parser.error('unknown workload %s' % workload)
+
+    with tempfile.TemporaryDirectory() as directory:
+        build = None
+        if any(w.startswith('elf') or w == 'trace' for w in workloads):
+            if shutil.which(args.cc) is None:
+                print('%s not found, skipping the elf and trace workloads' % args.cc)
+                workloads = [w for w in workloads if not (w.startswith('elf') or w == 'trace')]
+            else:
+                callees = random_call_graph(args.elf_functions, args.fanout, args.seed)
+                (binary, map_file) = build_program(directory, callees, *PROGRAM_FILES,
+                                                   cc=args.cc)
+                build = {'binary': binary, 'map': map_file}
+        results = {'version': RESULTS_VERSION,
+                   'python': platform.python_version(),
+                   'parameters': params,
+                   'workloads': run_benchmarks(workloads, params, build, args.repeat)}
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        print('\n%d regression%s' % (regressions, '' if regressions == 1 else 's'))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import subprocess
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'encutils-cache')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def file_digest(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def bytes_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def tool_version(tool):
+    try:
+        out = subprocess.check_output([tool, '--version'], encoding='utf-8',
+                                      stderr=subprocess.DEVNULL)
+        return out.split('\n')[0]
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def make_key(*parts):
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class CacheDirectory:
+    # A flat directory of cache entries, one file per key. Entries are
+    # written atomically and the directory is kept under max_bytes by
+    # evicting the least recently used entries. An entry's mtime is its
+    # last use time.
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key, suffix):
+        path = self.path(key, suffix)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, suffix, data, evict=True):
+        # Write to a temporary file in the same directory and rename it into
+        # place so that readers never see a partially written entry.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path(key, suffix))
+        except:
+            os.unlink(tmp)
+            raise
+        if evict:
+            self.evict()
+        return self.path(key, suffix)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for (mtime, size, path) in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
@@ -4,13 +4,27 @@
 
 
 import argparse
-import pickle
-import tempfile
-from elf_parser_factory import get_elf_parser
-import os
+import contextlib
+import sys
+import paths
+import stats
+import trace
+import walker
+from elf_parser_factory import get_elf_parser, get_elf_parser_class
+from dwarf_lines import open_line_table
+from graph_cache import GraphCache, is_graph_file, load_graph_file
+from graph_diff import GraphDiff, add_code_hashes
+from graph_export import FORMATS, GraphExport, caller_subgraph
+from native_elf_parser import NativeElfParser
+from query_server import QueryEngine, serve
+from reachability import GraphReachability, ReachabilityIndex, load_cached_index, store_cached_index
+from relocations import RelocationEdges
+from utility import source_names
+from walker import LineWriter
 
 colorize = True
 location = False
+show_sources = False
 
 name_color = '\033[1;38;5;170m'
 address_color = '\033[0;38;5;106m'
@@ -20,55 +34,114 @@ recur_color = '\033[0;31m'
 colorize = lambda str, c: ('%s%s\033[0m' % (c, str))
     
 
-def print_callstacks(table, fcnname, depth):
-    def walk(stack, fcn, d, last=[]):
-        desc = '%s %s' % (colorize(fcn.name, name_color), colorize(hex(fcn.address), address_color))
-        if location and fcn.location:
-            desc += ' %s' % colorize(fcn.location, location_color)
-        prefix = ''
-        for l in last[:-1]:
-            prefix += ('\u2502   ' if not l else '    ')
-        
-        if len(stack) > 0:
-            prefix = '  ' + prefix
-            if last[-1]:
-                prefix += '\u2514'
-            else:
-                prefix += '\u251c'                
-            prefix += '\u2500\u2500'
-            
-        if len(stack) == depth and len(fcn.callers) > 0:
-            desc += ' ' + colorize('...', more_color)
-        if fcn in stack:
-            desc += ' ' + colorize(' possible recursive call ', recur_color)
-
-        print('%s %s' % (prefix, desc))
-        if len(stack) == depth or fcn in stack:
-            return
-        
-        stack.append(fcn)                           
-        if len(fcn.callers) == 0:
-            pass
-        else:
-            for idx in range(0, len(fcn.callers)):
-                caller = fcn.callers[idx]
-                walk(stack, caller, d+1, last + [idx == len(fcn.callers)-1])
-        stack.pop(-1)
-
-    fcns = table.lookup_by_name(fcnname)
-    if len(fcns) > 0:
-        for fcn in fcns:
-            walk([], fcn, 0)
-    else:
-        print('Function %s not found. Displaying possible matches.' % fcnname)
-        for name in table.get_function_names():
-            if fcnname in name:
-                print_callstacks(table, name, depth)
+def describe_function(table, fcn):
+    desc = '%s %s' % (colorize(fcn.name, name_color), colorize(hex(fcn.address), address_color))
+    loc = table.location(fcn) if location else None
+    if loc:
+        desc += ' %s' % colorize(loc, location_color)
+    return desc
+
+
+def describe_edge(table, caller, callee):
+    return colorize('[%s]' % ', '.join(source_names(table.edge_sources(caller, callee))),
+                    location_color)
+
+
+def mark(kind, text):
+    return colorize(text, more_color if kind == 'more' else recur_color)
+
+
+def print_callstacks(table, fcnname, depth, writer, back_references=False):
+    edge = None
+    if show_sources:
+        edge = lambda caller, callee: describe_edge(table, caller, callee)
+    walker.print_callstacks(table.lookup_by_name, fcnname, depth,
+                            lambda fcn: describe_function(table, fcn), mark, writer,
+                            back_references, table.find_names, edge)
+
+
+def print_call_paths(table, source, target, count, depth, writer):
+    paths.print_call_paths(table.lookup_by_name, source, target, count, depth,
+                           lambda fcn: describe_function(table, fcn), mark, writer)
+
+def add_linker_map(table, linker_map, args):
+    # Progress messages of trace.py go to stderr, apart from the callstacks.
+    # Without -j, trace.py loads the objects with one process per CPU.
+    object_cache = trace.ObjectCache(args.cache_dir) if args.cache else None
+    with contextlib.redirect_stdout(sys.stderr):
+        (objects, functions) = trace.read_linker_map(linker_map, args.jobs, object_cache)
+    trace.add_linker_map_edges(table, objects, functions)
+
+def load_callers(binary_file_name, names, depth, location):
+    # The graph of only the callers of the named functions within depth
+    # calls, see --lazy.
+    elf_parser = NativeElfParser(binary_file_name, location, False)
+    table = elf_parser.functions_table
+    roots = []
+    for name in names:
+        fcns = table.lookup_by_name(name)
+        if not fcns:
+            fcns = [fcn for match in table.find_names(name) for fcn in table.lookup_by_name(match)]
+        roots.extend(fcns)
+    elf_parser.analyze_callers(roots, depth)
+    return table
+
+def load_graph(binary_file_name, args, location, code_hashes=False, linker_map=None):
+    # Returns (table, graph cache, cache key); the cache is None without -c.
+    # The call edges of linker_map, a map file of the binary, are added to
+    # those found in the binary.
+    table = None
+    graph_cache = None
+    cache_key = None
+    backend = args.backend
+    if args.edges == 'relocations':
+        backend = 'native'
+    if args.cache:
+        graph_cache = GraphCache(args.cache_dir)
+        cache_key = graph_cache.key(binary_file_name, get_elf_parser_class(backend), location,
+                                    args.edges, linker_map)
+        with stats.phase('cache-load'):
+            table = graph_cache.load(cache_key)
+        stats.count('graph-cache-misses' if table is None else 'graph-cache-hits')
+        if table is not None and location:
+            table.locator = open_line_table(binary_file_name)
+
+    store = False
+    if table is None:
+        elf_parser = get_elf_parser(binary_file_name, location, args.stream,
+                                    not args.no_disassembly, backend,
+                                    args.edges != 'relocations', args.jobs or 1)
+        if args.edges != 'disassembly':
+            with stats.phase('relocations'):
+                relocation_edges = RelocationEdges(binary_file_name)
+                relocation_edges.add_edges(elf_parser.functions_table)
+        elf_parser.analyze()
+        table = elf_parser.functions_table
+        if linker_map is not None:
+            add_linker_map(table, linker_map, args)
+        store = True
+    if code_hashes and not table.code_hashes:
+        with stats.phase('hash'):
+            add_code_hashes(binary_file_name, table)
+        store = True
+    if args.cache and store:
+        with stats.phase('cache-store'):
+            graph_cache.store(cache_key, table)
+    return (table, graph_cache, cache_key)
+
+def load_diff_side(path, args, location, linker_map=None):
+    # A side of --diff, given as a binary or a cached .graph file. Returns
+    # (table, graph cache, cache key) as load_graph() does; the table is
+    # None if path is a graph file that can not be read.
+    if is_graph_file(path):
+        with stats.phase('cache-load'):
+            return (load_graph_file(path), None, None)
+    return load_graph(path, args, location, True, linker_map)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Analyze enclave binary.')
     parser.add_argument('elf', help='path to enclave binary')
-    parser.add_argument('function-name',  nargs='+',                        
+    parser.add_argument('function-name',  nargs='*',                        
                         help='function to print callstack for')
     parser.add_argument('-nc', '--no-color', metavar='', default=False,
                         action='store_const', const=True,
@@ -80,38 +153,164 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--cache', metavar='', default=False,
                         action='store_const', const=True,
                         help='cache processed data to speed up analysis')
-    args = parser.parse_args()
+    parser.add_argument('--cache-dir', metavar='', default=None,
+                        help='directory for the analysis cache')
+    parser.add_argument('-s', '--stream', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='parse disassembly while it is produced instead of buffering it')
+    parser.add_argument('-j', '--jobs', metavar='', default=None, type=int,
+                        help='number of processes parsing the disassembly; with more than one, '
+                             'per-function disassembly is not kept (default=1, or one per CPU '
+                             'for the objects of --map)')
+    parser.add_argument('-b', '--backend', metavar='', default=None,
+                        choices=['llvm-objdump', 'objdump', 'native'],
+                        help='ELF parser backend: llvm-objdump, objdump or native (default=first available)')
+    parser.add_argument('-e', '--edges', metavar='', default='disassembly',
+                        choices=['disassembly', 'relocations', 'all'],
+                        help='where call edges come from: disassembly, relocations '
+                             '(symbol table, relocations and function pointer tables, no '
+                             'disassembly) or all (default=disassembly)')
+    parser.add_argument('-m', '--map', metavar='', default=None,
+                        help='linker map of the binary, from ld -Map and --cref; the call edges '
+                             'of the objects it loads are added to the graph')
+    parser.add_argument('-l', '--lazy', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='decode only the functions that may call the named functions within '
+                             'depth calls, found by scanning the code for call, jmp and lea '
+                             'bytes, instead of the whole binary; for callstacks and --export '
+                             'of callers only, with the native backend and without -c')
+    parser.add_argument('--sources', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='show where each call edge was found: disassembly, relocations '
+                             'or linker-map')
+    parser.add_argument('-nd', '--no-disassembly', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='keep only call edges instead of per-function disassembly')
+    parser.add_argument('-r', '--back-references', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='print each caller subtree once and refer back to it afterwards')
+    parser.add_argument('-p', '--path-to', metavar='', default=None,
+                        help='print call paths from each function to this function, of at most '
+                             'depth calls, instead of callstacks')
+    parser.add_argument('-k', '--paths', metavar='', default=1, type=int,
+                        help='number of paths to print with --path-to, shortest first (default=1)')
+    parser.add_argument('--reaches', metavar='', default=None,
+                        help='print whether each function can reach this function instead of callstacks')
+    parser.add_argument('--diff', metavar='', default=None,
+                        help='compare with an older build, given as a binary or a cached .graph '
+                             'file, and report reachability changes from each function')
+    parser.add_argument('-x', '--export', metavar='', default=None,
+                        help='write the graph to this file instead of printing callstacks; '
+                             'with function names, only their callers up to depth (- for stdout)')
+    parser.add_argument('--format', metavar='', default=None, choices=FORMATS,
+                        help='export format: jsonl, dot, graphml or csr (default=from the '
+                             'file extension, else jsonl)')
+    parser.add_argument('--serve', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='answer JSON line queries on stdin instead of printing callstacks')
+    parser.add_argument('--socket', metavar='', default=None,
+                        help='answer JSON line queries on a Unix socket at this path')
+    parser.add_argument('--stats', metavar='', default=None,
+                        help='write phase times and counters as JSON to this file (- for stderr)')
+    parser.add_argument('--profile', metavar='', default=None,
+                        help='write a cProfile profile of the run to this file')
+    parser.add_argument('--trace-memory', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='trace allocations and add the largest to the --stats report')
+    args = parser.parse_intermixed_args()
+    serving = args.serve or args.socket is not None
+    if not serving and args.diff is None and args.export is None and \
+       not args.__dict__['function-name']:
+        parser.error('the following arguments are required: function-name')
+    if serving and args.__dict__['function-name']:
+        parser.error('function names can not be given with --serve or --socket')
+    if args.lazy and (serving or args.diff is not None or args.reaches is not None or
+                      args.path_to is not None or args.map is not None or
+                      args.edges != 'disassembly' or not args.__dict__['function-name']):
+        parser.error('--lazy only prints callstacks or exports the callers of named functions')
+    if args.lazy and (args.cache or args.backend not in (None, 'native')):
+        parser.error('--lazy decodes with the native backend and does not use the cache')
 
     if args.no_color:
         colorize = lambda str, c: str
 
+    profiler = stats.start_capture(args.profile, args.trace_memory)
     location = not args.no_location
-    table = None
-    cache_used = False
-    if args.cache:
-        elfname_id = args.elf.replace('/', '_')
-        cache_file = os.path.join(tempfile.gettempdir(), elfname_id + '.cache')
-        #TODO: Check timestamps
-        try:
-            t1 = os.path.getmtime(args.elf)
-            t2 = os.path.getmtime(cache_file)
-            if t2 > t1:
-                table = pickle.load(open(cache_file, 'rb'))
-                cache_used = True
-        except:
-            pass
-
-    elf_parser = get_elf_parser(args.elf, location) 
-    if not table:
-        table = elf_parser.functions_table
+    show_sources = args.sources
+    (graph_cache, cache_key) = (None, None)
+    if args.lazy:
+        table = load_callers(args.elf, args.__dict__['function-name'], args.depth, location)
+    elif args.diff is not None:
+        (table, graph_cache, cache_key) = load_diff_side(args.elf, args, location, args.map)
+        if table is None:
+            parser.error('%s is not a readable graph file' % args.elf)
     else:
-        elf_parser.functions_table = table
+        (table, graph_cache, cache_key) = load_graph(args.elf, args, location, False, args.map)
+    stats.record('functions', len(table.table))
+    stats.record('edges', table.graph.edge_count)
 
-    if args.cache and not cache_used:
-        pickle.dump(table, open(cache_file, 'wb'))
+    reachability = None
+    if serving or args.reaches is not None:
+        index = None
+        if graph_cache is not None:
+            with stats.phase('cache-load'):
+                index = load_cached_index(graph_cache, cache_key, len(table.graph.nodes))
+            stats.count('index-cache-misses' if index is None else 'index-cache-hits')
+        if index is None:
+            with stats.phase('reachability'):
+                index = ReachabilityIndex(table.graph)
+            if graph_cache is not None:
+                with stats.phase('cache-store'):
+                    store_cached_index(graph_cache, cache_key, index)
+        reachability = GraphReachability(table.graph, index, lambda fcn: fcn.address)
 
-    elf_parser.analyze()
-        
     names = args.__dict__['function-name']
-    for name in names:
-        print_callstacks(table, name, args.depth)
+    writer = LineWriter()
+    if args.export is not None:
+        nodes = list(table.functions())
+        if names:
+            roots = [fcn for name in names for fcn in table.lookup_by_name(name)]
+            nodes = caller_subgraph(roots, args.depth)
+        def attributes(fcn):
+            return [('name', fcn.name), ('address', hex(fcn.address)),
+                    ('location', (table.location(fcn) or None) if location else None)]
+        def edge_attributes(caller, callee):
+            return [('sources', ','.join(source_names(table.edge_sources(caller, callee))))]
+        with stats.phase('export'):
+            GraphExport(nodes, attributes, edge_attributes).write(args.export, args.format)
+    elif args.diff is not None:
+        old_table = load_diff_side(args.diff, args, location)[0]
+        if old_table is None:
+            parser.error('%s is not a readable graph file' % args.diff)
+        with stats.phase('diff'):
+            GraphDiff(old_table, table, names).report(writer)
+    elif args.reaches is not None:
+        targets = table.lookup_by_name(args.reaches)
+        if not targets:
+            writer.write('Function %s not found' % args.reaches)
+        for name in names if targets else []:
+            sources = table.lookup_by_name(name)
+            if not sources:
+                writer.write('Function %s not found' % name)
+            elif reachability.reaches(sources, targets):
+                writer.write('%s reaches %s' % (name, args.reaches))
+            else:
+                writer.write('%s does not reach %s' % (name, args.reaches))
+    elif args.path_to is not None:
+        with stats.phase('paths'):
+            for name in names:
+                print_call_paths(table, name, args.path_to, args.paths, args.depth, writer)
+    else:
+        with stats.phase('walk'):
+            for name in names:
+                print_callstacks(table, name, args.depth, writer, args.back_references)
+    writer.flush()
+    stats.finish_capture(profiler, args.profile, args.stats)
+
+    if serving:
+        def describe(fcn):
+            desc = {'name': fcn.name, 'address': hex(fcn.address)}
+            if location and table.location(fcn):
+                desc['location'] = table.location(fcn)
+            return desc
+        serve(QueryEngine(table.lookup_by_name, describe, reachability), args.socket)
@@ -0,0 +1,410 @@
+import bisect
+import posixpath
+import struct
+from array import array
+from elf_file import ElfError, ElfFile
+
+DW_LNS_copy = 1
+DW_LNS_advance_pc = 2
+DW_LNS_advance_line = 3
+DW_LNS_set_file = 4
+DW_LNS_const_add_pc = 8
+DW_LNS_fixed_advance_pc = 9
+
+DW_LNE_end_sequence = 1
+DW_LNE_set_address = 2
+DW_LNE_define_file = 3
+
+DW_LNCT_path = 1
+DW_LNCT_directory_index = 2
+
+DW_AT_stmt_list = 0x10
+DW_AT_comp_dir = 0x1b
+
+DW_FORM_addr = 0x01
+DW_FORM_block2 = 0x03
+DW_FORM_block4 = 0x04
+DW_FORM_flag = 0x0c
+DW_FORM_sdata = 0x0d
+DW_FORM_ref_addr = 0x10
+DW_FORM_ref1 = 0x11
+DW_FORM_ref2 = 0x12
+DW_FORM_ref4 = 0x13
+DW_FORM_ref8 = 0x14
+DW_FORM_ref_udata = 0x15
+DW_FORM_sec_offset = 0x17
+DW_FORM_exprloc = 0x18
+DW_FORM_flag_present = 0x19
+DW_FORM_block = 0x09
+DW_FORM_block1 = 0x0a
+DW_FORM_data1 = 0x0b
+DW_FORM_data2 = 0x05
+DW_FORM_data4 = 0x06
+DW_FORM_data8 = 0x07
+DW_FORM_data16 = 0x1e
+DW_FORM_line_strp = 0x1f
+DW_FORM_string = 0x08
+DW_FORM_strp = 0x0e
+DW_FORM_udata = 0x0f
+
+# Marks the row that ends a sequence; addresses past it have no line.
+END_OF_SEQUENCE = 0xffffffff
+
+
+class DwarfError(Exception):
+    pass
+
+
+class Reader:
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def u8(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def s8(self):
+        value = self.u8()
+        return value - 256 if value >= 128 else value
+
+    def unpack(self, fmt, size):
+        value = struct.unpack_from(fmt, self.data, self.pos)[0]
+        self.pos += size
+        return value
+
+    def uleb(self):
+        result = 0
+        shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                return result
+
+    def sleb(self):
+        result = 0
+        shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                if byte & 0x40:
+                    result -= 1 << shift
+                return result
+
+    def cstring(self):
+        end = self.data.index(b'\0', self.pos)
+        value = bytes(self.data[self.pos:end]).decode('utf-8', 'replace')
+        self.pos = end + 1
+        return value
+
+
+class LineTable:
+    # Address to (file, line) index built from .debug_line. The section is
+    # only parsed on the first lookup.
+    def __init__(self, elf):
+        self.elf = elf
+        self.addresses = None
+        self.file_ids = None
+        self.lines = None
+        self.files = []
+        # DW_AT_comp_dir by line program offset, for DWARF 2-4 units whose
+        # directory 0 is implicit.
+        self.comp_dirs = None
+
+    def string_at(self, section_name, offset):
+        section = self.elf.section(section_name)
+        if section is None:
+            raise DwarfError('%s not found' % section_name)
+        return Reader(self.elf.section_data(section), offset).cstring()
+
+    def read_entry_formats(self, r):
+        return [(r.uleb(), r.uleb()) for i in range(r.u8())]
+
+    def read_form(self, r, form, offset_size):
+        if form == DW_FORM_string:
+            return r.cstring()
+        if form == DW_FORM_line_strp or form == DW_FORM_strp:
+            offset = r.unpack('<Q' if offset_size == 8 else '<I', offset_size)
+            name = '.debug_line_str' if form == DW_FORM_line_strp else '.debug_str'
+            return self.string_at(name, offset)
+        if form == DW_FORM_udata:
+            return r.uleb()
+        if form == DW_FORM_data1:
+            return r.u8()
+        if form == DW_FORM_data2:
+            return r.unpack('<H', 2)
+        if form == DW_FORM_data4:
+            return r.unpack('<I', 4)
+        if form == DW_FORM_data8:
+            return r.unpack('<Q', 8)
+        if form == DW_FORM_data16:
+            r.pos += 16
+            return None
+        if form == DW_FORM_block:
+            r.pos += r.uleb()
+            return None
+        if form == DW_FORM_block1:
+            r.pos += r.u8()
+            return None
+        if form == DW_FORM_block2:
+            r.pos += r.unpack('<H', 2)
+            return None
+        if form == DW_FORM_block4:
+            r.pos += r.unpack('<I', 4)
+            return None
+        if form == DW_FORM_exprloc:
+            r.pos += r.uleb()
+            return None
+        if form == DW_FORM_flag or form == DW_FORM_ref1:
+            return r.u8()
+        if form == DW_FORM_ref2:
+            return r.unpack('<H', 2)
+        if form == DW_FORM_ref4:
+            return r.unpack('<I', 4)
+        if form == DW_FORM_ref8:
+            return r.unpack('<Q', 8)
+        if form == DW_FORM_ref_udata:
+            return r.uleb()
+        if form == DW_FORM_sdata:
+            return r.sleb()
+        if form == DW_FORM_flag_present:
+            return 1
+        if form == DW_FORM_sec_offset or form == DW_FORM_ref_addr:
+            return r.unpack('<Q' if offset_size == 8 else '<I', offset_size)
+        raise DwarfError('unsupported form 0x%x in line table header' % form)
+
+    def read_entries(self, r, offset_size):
+        formats = self.read_entry_formats(r)
+        entries = []
+        for i in range(r.uleb()):
+            entry = {}
+            for (content, form) in formats:
+                entry[content] = self.read_form(r, form, offset_size)
+            entries.append(entry)
+        return entries
+
+    def read_comp_dirs(self):
+        # Reads DW_AT_stmt_list and DW_AT_comp_dir from the first DIE of
+        # each DWARF 2-4 compilation unit.
+        self.comp_dirs = {}
+        info = self.elf.section('.debug_info')
+        abbrev = self.elf.section('.debug_abbrev')
+        if info is None or abbrev is None:
+            return
+        info_data = self.elf.section_data(info)
+        abbrev_data = self.elf.section_data(abbrev)
+        pos = 0
+        while pos < len(info_data):
+            r = Reader(info_data, pos)
+            unit_length = r.unpack('<I', 4)
+            offset_size = 4
+            if unit_length == 0xffffffff:
+                unit_length = r.unpack('<Q', 8)
+                offset_size = 8
+            pos = r.pos + unit_length
+            if r.unpack('<H', 2) > 4:
+                continue
+            abbrev_offset = r.unpack('<Q' if offset_size == 8 else '<I', offset_size)
+            address_size = r.u8()
+            code = r.uleb()
+
+            a = Reader(abbrev_data, abbrev_offset)
+            specs = None
+            while specs is None:
+                entry_code = a.uleb()
+                if entry_code == 0:
+                    break
+                a.uleb()
+                a.u8()
+                entry_specs = []
+                while True:
+                    (name, form) = (a.uleb(), a.uleb())
+                    if name == 0 and form == 0:
+                        break
+                    entry_specs.append((name, form))
+                if entry_code == code:
+                    specs = entry_specs
+            if specs is None:
+                continue
+
+            try:
+                attrs = {}
+                for (name, form) in specs:
+                    if form == DW_FORM_addr:
+                        r.pos += address_size
+                        continue
+                    attrs[name] = self.read_form(r, form, offset_size)
+            except DwarfError:
+                continue
+            if DW_AT_stmt_list in attrs and DW_AT_comp_dir in attrs:
+                self.comp_dirs[attrs[DW_AT_stmt_list]] = attrs[DW_AT_comp_dir]
+
+    def resolve_directories(self, directories):
+        # Directory entries other than the first are relative to the
+        # compilation directory in directory 0.
+        if not directories or not directories[0]:
+            return directories
+        return [directories[0]] + [posixpath.join(directories[0], d)
+                                   for d in directories[1:]]
+
+    def add_file(self, directory, name):
+        if directory and not posixpath.isabs(name):
+            name = posixpath.join(directory, name)
+        self.files.append(name)
+        return len(self.files) - 1
+
+    def parse_unit(self, data, pos, rows):
+        r = Reader(data, pos)
+        unit_length = r.unpack('<I', 4)
+        offset_size = 4
+        if unit_length == 0xffffffff:
+            unit_length = r.unpack('<Q', 8)
+            offset_size = 8
+        end = r.pos + unit_length
+
+        version = r.unpack('<H', 2)
+        if version < 2 or version > 5:
+            return end
+        if version >= 5:
+            r.pos += 2
+        header_length = r.unpack('<Q' if offset_size == 8 else '<I', offset_size)
+        program = r.pos + header_length
+        min_inst_length = r.u8()
+        if version >= 4:
+            r.u8()
+        default_is_stmt = r.u8()
+        line_base = r.s8()
+        line_range = r.u8()
+        opcode_base = r.u8()
+        opcode_lengths = [r.u8() for i in range(opcode_base - 1)]
+
+        # Map the unit's file numbers to indices in self.files.
+        file_ids = {}
+        if version >= 5:
+            directories = self.resolve_directories(
+                [e.get(DW_LNCT_path, '') for e in self.read_entries(r, offset_size)])
+            for (idx, e) in enumerate(self.read_entries(r, offset_size)):
+                d = e.get(DW_LNCT_directory_index, 0)
+                file_ids[idx] = self.add_file(directories[d] if d < len(directories) else '',
+                                              e.get(DW_LNCT_path, ''))
+        else:
+            if self.comp_dirs is None:
+                self.read_comp_dirs()
+            directories = [self.comp_dirs.get(pos, '')]
+            while True:
+                d = r.cstring()
+                if not d:
+                    break
+                directories.append(d)
+            directories = self.resolve_directories(directories)
+            idx = 1
+            while True:
+                name = r.cstring()
+                if not name:
+                    break
+                d = r.uleb()
+                r.uleb()
+                r.uleb()
+                file_ids[idx] = self.add_file(directories[d] if d < len(directories) else '', name)
+                idx += 1
+
+        r.pos = program
+        const_add_pc = ((255 - opcode_base) // line_range) * min_inst_length
+        address = 0
+        file = 1
+        line = 1
+        sequence_start = len(rows)
+        while r.pos < end:
+            op = data[r.pos]
+            r.pos += 1
+            if op >= opcode_base:
+                adjusted = op - opcode_base
+                address += (adjusted // line_range) * min_inst_length
+                line += line_base + adjusted % line_range
+                rows.append((address, file_ids.get(file, END_OF_SEQUENCE), line))
+            elif op == 0:
+                length = r.uleb()
+                next_pos = r.pos + length
+                sub = data[r.pos]
+                r.pos += 1
+                if sub == DW_LNE_end_sequence:
+                    # Rows at the end address cover no code.
+                    while len(rows) > sequence_start and rows[-1][0] >= address:
+                        rows.pop()
+                    rows.append((address, END_OF_SEQUENCE, 0))
+                    sequence_start = len(rows)
+                    address = 0
+                    file = 1
+                    line = 1
+                elif sub == DW_LNE_set_address:
+                    address = int.from_bytes(data[r.pos:next_pos], 'little')
+                elif sub == DW_LNE_define_file:
+                    name = r.cstring()
+                    d = r.uleb()
+                    file_ids[max(file_ids.keys(), default=0) + 1] = self.add_file(
+                        directories[d] if d < len(directories) else '', name)
+                r.pos = next_pos
+            elif op == DW_LNS_copy:
+                rows.append((address, file_ids.get(file, END_OF_SEQUENCE), line))
+            elif op == DW_LNS_advance_pc:
+                address += r.uleb() * min_inst_length
+            elif op == DW_LNS_advance_line:
+                line += r.sleb()
+            elif op == DW_LNS_set_file:
+                file = r.uleb()
+            elif op == DW_LNS_const_add_pc:
+                address += const_add_pc
+            elif op == DW_LNS_fixed_advance_pc:
+                address += r.unpack('<H', 2)
+            else:
+                for i in range(opcode_lengths[op - 1]):
+                    r.uleb()
+        return end
+
+    def build(self):
+        rows = []
+        section = self.elf.section('.debug_line')
+        if section is not None:
+            data = self.elf.section_data(section)
+            pos = 0
+            while pos < len(data):
+                pos = self.parse_unit(data, pos, rows)
+
+        # End-of-sequence rows sort before rows that start at the same
+        # address, so that a lookup finds the row that starts there.
+        rows.sort(key=lambda row: (row[0], row[1] != END_OF_SEQUENCE))
+        self.addresses = array('Q', (row[0] for row in rows))
+        self.file_ids = array('I', (row[1] for row in rows))
+        self.lines = array('I', (row[2] for row in rows))
+
+    def lookup(self, address):
+        if self.addresses is None:
+            self.build()
+        idx = bisect.bisect_right(self.addresses, address) - 1
+        if idx < 0 or self.file_ids[idx] == END_OF_SEQUENCE:
+            return None
+        # Use the first row at an address, which for a function start is the
+        # line of its opening.
+        while idx > 0 and self.addresses[idx - 1] == self.addresses[idx] and \
+              self.file_ids[idx - 1] != END_OF_SEQUENCE:
+            idx -= 1
+        return '%s:%d' % (self.files[self.file_ids[idx]], self.lines[idx])
+
+
+def open_line_table(binary_file_name):
+    # Locations come from .debug_line when the binary has it, looked up only
+    # for the functions that get printed.
+    try:
+        elf = ElfFile(binary_file_name)
+    except (OSError, ValueError, ElfError):
+        return None
+    if elf.section('.debug_line') is None:
+        return None
+    return LineTable(elf)
@@ -0,0 +1,133 @@
+import mmap
+import struct
+from collections import namedtuple
+
+Section = namedtuple('Section', 'name type flags address offset size link info entsize')
+Symbol = namedtuple('Symbol', 'name value size type bind section_index')
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHF_EXECINSTR = 0x4
+
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_SECTION = 3
+
+ELF64_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+ELF64_SECTION = struct.Struct('<IIQQQQIIQQ')
+ELF64_SYMBOL = struct.Struct('<IBBHQQ')
+
+
+class ElfError(Exception):
+    pass
+
+
+class ElfFile:
+    # Read-only view of a 64-bit little endian ELF file through mmap.
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        ident = self.data[:16]
+        if ident[:4] != ELF_MAGIC:
+            raise ElfError('%s is not an ELF file' % filename)
+        if ident[4] != ELFCLASS64 or ident[5] != ELFDATA2LSB:
+            raise ElfError('%s is not a 64-bit little endian ELF file' % filename)
+
+        header = ELF64_HEADER.unpack_from(self.data, 0)
+        self.type = header[1]
+        self.machine = header[2]
+        self.entry = header[4]
+        shoff = header[6]
+        shentsize = header[11]
+        shnum = header[12]
+        shstrndx = header[13]
+
+        raw = [ELF64_SECTION.unpack_from(self.data, shoff + i * shentsize)
+               for i in range(shnum)]
+        names = raw[shstrndx] if shstrndx < shnum else None
+        self.sections = []
+        for s in raw:
+            name = self.read_string(names[4], s[0]) if names else ''
+            self.sections.append(Section(name=name, type=s[1], flags=s[2],
+                                         address=s[3], offset=s[4], size=s[5],
+                                         link=s[6], info=s[7], entsize=s[9]))
+
+    def close(self):
+        self.data.close()
+
+    def read_string(self, offset, index):
+        start = offset + index
+        end = self.data.find(b'\0', start)
+        return self.data[start:end].decode('utf-8', 'replace')
+
+    def section(self, name):
+        for s in self.sections:
+            if s.name == name:
+                return s
+        return None
+
+    def section_data(self, section):
+        if section.type == SHT_NOBITS:
+            return b''
+        return self.data[section.offset:section.offset + section.size]
+
+    def symbols(self, section_name):
+        section = self.section(section_name)
+        if section is None:
+            return []
+        return self.symbol_table(section)
+
+    def symbol_table(self, section):
+        strtab = self.sections[section.link]
+        entsize = section.entsize or ELF64_SYMBOL.size
+        symbols = []
+        for pos in range(section.offset, section.offset + section.size, entsize):
+            (name, info, other, shndx, value, size) = ELF64_SYMBOL.unpack_from(self.data, pos)
+            symbols.append(Symbol(name=self.read_string(strtab.offset, name),
+                                  value=value,
+                                  size=size,
+                                  type=info & 0xf,
+                                  bind=info >> 4,
+                                  section_index=shndx))
+        return symbols
+
+    def function_symbols(self):
+        # Defined functions in executable sections, from .symtab if present
+        # and .dynsym otherwise. Aliases at the same address are collapsed
+        # to the first name seen. Functions without a size (often hand
+        # written assembly) are taken to extend to the next function or the
+        # end of their section.
+        symbols = self.symbols('.symtab') or self.symbols('.dynsym')
+        functions = {}
+        for sym in symbols:
+            if sym.type != STT_FUNC or not sym.name:
+                continue
+            if sym.section_index == 0 or sym.section_index >= len(self.sections):
+                continue
+            if not self.sections[sym.section_index].flags & SHF_EXECINSTR:
+                continue
+            if sym.value not in functions or functions[sym.value].size == 0:
+                functions[sym.value] = sym
+
+        functions = sorted(functions.values(), key=lambda sym: sym.value)
+        for (idx, sym) in enumerate(functions):
+            if sym.size != 0:
+                continue
+            section = self.sections[sym.section_index]
+            end = section.address + section.size
+            if idx + 1 < len(functions):
+                end = min(end, functions[idx + 1].value)
+            functions[idx] = sym._replace(size=end - sym.value)
+        return functions
+
+    def read_at(self, section, address, size):
+        # Bytes of an address range that lies within section.
+        start = section.offset + address - section.address
+        return self.data[start:start + size]
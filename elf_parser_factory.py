@@ -2,14 +2,31 @@ import shutil
 import sys
 from objdump_parser import ObjDumpParser
 from llvm_objdump_parser import LLVMObjDumpParser
+from native_elf_parser import NativeElfParser
 
-def get_elf_parser(binary_file_name, show_symbol_files):
+BACKENDS = {
+    'llvm-objdump': LLVMObjDumpParser,
+    'objdump': ObjDumpParser,
+    'native': NativeElfParser,
+}
+
+def get_elf_parser_class(backend=None):
+    if backend is not None:
+        return BACKENDS[backend]
     if shutil.which("llvm-objdump") is not None:
-            return LLVMObjDumpParser(binary_file_name, show_symbol_files)
-    else:
-        if sys.platform == "Win32":
-            return None
-        elif "linux" in sys.platform:
-            return ObjDumpParser(binary_file_name, show_symbol_files)
+            return LLVMObjDumpParser
+    elif "linux" in sys.platform and shutil.which("objdump") is not None:
+            return ObjDumpParser
+    # Neither tool is available; read the ELF file directly.
+    return NativeElfParser
+
+def get_elf_parser(binary_file_name, show_symbol_files, streaming=False, keep_code=True, backend=None,
+                   disassemble=True, jobs=1):
+    parser_class = get_elf_parser_class(backend)
+    if parser_class is LLVMObjDumpParser:
+        return LLVMObjDumpParser(binary_file_name, show_symbol_files, keep_code, jobs)
+    elif parser_class is ObjDumpParser:
+        return ObjDumpParser(binary_file_name, show_symbol_files, streaming, keep_code, jobs)
+    elif parser_class is NativeElfParser:
+        return NativeElfParser(binary_file_name, show_symbol_files, disassemble)
     return None
-        
@@ -0,0 +1,189 @@
+import mmap
+import struct
+from array import array
+from cache import CacheDirectory, file_digest, make_key, tool_version
+from utility import Function, FunctionTable
+
+# On-disk layout of an analyzed FunctionTable. All integers are little
+# endian and every section starts on an 8 byte boundary:
+#
+#   header          magic, format version, node count, edge count,
+#                   size of the string blob
+#   addresses       Q[nodes]
+#   code hashes     Q[nodes]          0 where unknown
+#   string offsets  Q[2 * nodes + 1]  (name, location) per node
+#   callee offsets  I[nodes + 1]      CSR rows into callee ids
+#   callee ids      I[edges]
+#   edge sources    B[edges]          utility.EDGE_SOURCES bits, by callee id
+#   caller offsets  I[nodes + 1]      CSR rows into caller ids
+#   caller ids      I[edges]
+#   strings         utf-8 blob
+#
+# Callees and callers are both stored so that the discovery order of each
+# list is preserved exactly.
+MAGIC = b'ENCG'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sIIIQ')
+SUFFIX = '.graph'
+
+
+def align(pos):
+    return (pos + 7) & ~7
+
+
+def pad(data):
+    data.extend(b'\0' * (align(len(data)) - len(data)))
+
+
+def adjacency_csr(fcns, index, attr):
+    offsets = array('I', [0])
+    ids = array('I')
+    for f in fcns:
+        ids.extend(index[n.address] for n in getattr(f, attr))
+        offsets.append(len(ids))
+    return (offsets, ids)
+
+
+def dump_function_table(table):
+    fcns = list(table.functions())
+    index = {}
+    for (i, f) in enumerate(fcns):
+        index[f.address] = i
+
+    strings = bytearray()
+    string_offsets = array('Q', [0])
+    for f in fcns:
+        strings.extend(f.name.encode('utf-8'))
+        string_offsets.append(len(strings))
+        strings.extend((f.location or '').encode('utf-8'))
+        string_offsets.append(len(strings))
+
+    (callee_offsets, callee_ids) = adjacency_csr(fcns, index, 'callees')
+    (caller_offsets, caller_ids) = adjacency_csr(fcns, index, 'callers')
+    sources = array('B', (table.edge_sources(f, n) for f in fcns for n in f.callees))
+
+    data = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, len(fcns),
+                                 len(callee_ids), len(strings)))
+    hashes = array('Q', (table.code_hashes.get(f.address, 0) for f in fcns))
+    for section in [array('Q', (f.address for f in fcns)), hashes, string_offsets,
+                    callee_offsets, callee_ids, sources, caller_offsets, caller_ids]:
+        pad(data)
+        data.extend(section.tobytes())
+    pad(data)
+    data.extend(strings)
+    return bytes(data)
+
+
+def load_function_table(buf):
+    (magic, version, nodes, edges, strings_size) = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+
+    # (offset, format, count) of each section, checked against the size of
+    # buf before anything is cast so that a truncated file is rejected.
+    layout = []
+    pos = HEADER.size
+    for (fmt, count) in [('Q', nodes), ('Q', nodes), ('Q', 2 * nodes + 1),
+                         ('I', nodes + 1), ('I', edges), ('B', edges),
+                         ('I', nodes + 1), ('I', edges)]:
+        pos = align(pos)
+        layout.append((pos, fmt, count))
+        pos += count * struct.calcsize(fmt)
+    pos = align(pos)
+    if pos + strings_size > len(buf):
+        return None
+
+    # Every view is released before returning, or an mmap buf can not be
+    # closed.
+    view = memoryview(buf)
+    sections = []
+    strings = None
+    try:
+        for (offset, fmt, count) in layout:
+            sections.append(view[offset:offset + count * struct.calcsize(fmt)].cast(fmt))
+        strings = view[pos:pos + strings_size]
+
+        (addresses, hashes, string_offsets, callee_offsets, callee_ids, sources,
+         caller_offsets, caller_ids) = sections
+        if (string_offsets[-1] != strings_size or callee_offsets[-1] != edges
+                or caller_offsets[-1] != edges):
+            return None
+
+        table = FunctionTable()
+        fcns = []
+        for i in range(nodes):
+            name = bytes(strings[string_offsets[2*i]:string_offsets[2*i+1]])
+            loc = bytes(strings[string_offsets[2*i+1]:string_offsets[2*i+2]])
+            f = Function(name=name.decode('utf-8'),
+                         location=loc.decode('utf-8') or [],
+                         address=addresses[i],
+                         code=None,
+                         callees=[],
+                         callers=[])
+            table.add(f)
+            fcns.append(f)
+            if hashes[i]:
+                table.code_hashes[f.address] = hashes[i]
+
+        # Node ids in table.graph follow insertion order, which matches the
+        # stored order.
+        for (i, f) in enumerate(fcns):
+            for k in range(callee_offsets[i], callee_offsets[i+1]):
+                j = callee_ids[k]
+                f.callees.append(fcns[j])
+                table.graph.add_edge(i, j, sources[k])
+            for j in caller_ids[caller_offsets[i]:caller_offsets[i+1]]:
+                f.callers.append(fcns[j])
+    finally:
+        for section in sections:
+            section.release()
+        if strings is not None:
+            strings.release()
+        view.release()
+    return table
+
+
+def is_graph_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def load_graph_file(path):
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return load_function_table(buf)
+    except (OSError, ValueError, TypeError, IndexError, struct.error):
+        return None
+
+
+class GraphCache:
+    def __init__(self, directory=None, max_bytes=None):
+        if max_bytes is None:
+            self.cache = CacheDirectory(directory)
+        else:
+            self.cache = CacheDirectory(directory, max_bytes)
+
+    def key(self, binary_file_name, parser_class, show_symbol_files, edges='disassembly',
+            linker_map=None):
+        tool = getattr(parser_class, 'tool', None)
+        return make_key('graph', str(FORMAT_VERSION),
+                        file_digest(binary_file_name),
+                        parser_class.__name__,
+                        getattr(parser_class, 'version', ''),
+                        tool_version(tool) if tool else '',
+                        'locations' if show_symbol_files else '',
+                        edges,
+                        file_digest(linker_map) if linker_map else '')
+
+    def load(self, key):
+        path = self.cache.get(key, SUFFIX)
+        if path is None:
+            return None
+        return load_graph_file(path)
+
+    def store(self, key, table):
+        return self.cache.put(key, SUFFIX, dump_function_table(table))
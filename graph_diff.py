@@ -0,0 +1,149 @@
+import hashlib
+from elf_file import ElfFile
+from reachability import ReachabilityIndex
+from x86_decoder import LEGACY_PREFIXES, decode_instruction, signed32
+
+# Compares the call graphs of two builds. Functions are matched by name, and
+# a matched function has changed if the hash of its normalized code differs.
+# Normalization zeroes the rel32 and disp32 fields of calls, jumps and
+# RIP-relative operands, and immediates holding function addresses, and
+# hashes the names of their targets instead, so code that only moved does
+# not count as changed. Outgoing edges are only compared for functions that
+# were added or changed.
+
+
+def is_jcc_rel32(code, pos, length):
+    end = pos + length
+    while pos < end and code[pos] in LEGACY_PREFIXES:
+        pos += 1
+    return end - pos == 6 and code[pos] == 0x0f and 0x80 <= code[pos + 1] <= 0x8f
+
+
+def normalized_code_hash(code, address, table):
+    h = hashlib.blake2b(digest_size=8)
+    code = bytearray(code)
+    targets = []
+    pos = 0
+    while pos < len(code):
+        try:
+            (length, kind, field, target) = decode_instruction(code, pos)
+        except IndexError:
+            break
+        if kind is None and is_jcc_rel32(code, pos, length):
+            # Conditional branches, often to a .cold part of the function.
+            (kind, field) = ('jcc', length - 4)
+            target = signed32(code, pos + field)
+        if kind is not None:
+            code[pos + field:pos + field + 4] = b'\0\0\0\0'
+            target += address + pos + length
+            if address <= target < address + len(code):
+                targets.append('.%x' % (target - address))
+            elif target in table.table:
+                targets.append(table.table[target].name)
+            else:
+                targets.append('?')
+        elif length >= 5:
+            # Absolute function addresses in immediates, as in non-PIE code.
+            value = int.from_bytes(code[pos + length - 4:pos + length], 'little')
+            if value in table.table:
+                code[pos + length - 4:pos + length] = b'\0\0\0\0'
+                targets.append(table.table[value].name)
+        pos += length
+    h.update(code)
+    h.update('\0'.join(targets).encode('utf-8'))
+    # 0 marks an unknown hash.
+    return int.from_bytes(h.digest(), 'little') or 1
+
+
+def add_code_hashes(binary_file_name, table):
+    # Fills table.code_hashes for the functions of binary_file_name.
+    elf = ElfFile(binary_file_name)
+    try:
+        for sym in elf.function_symbols():
+            if sym.value in table.table and sym.value not in table.code_hashes:
+                code = elf.read_at(elf.sections[sym.section_index], sym.value, sym.size)
+                table.code_hashes[sym.value] = normalized_code_hash(code, sym.value, table)
+    finally:
+        elf.close()
+
+
+def functions_by_key(table):
+    # Functions keyed by (name, n) where n tells apart functions that share
+    # a name, in address order.
+    keyed = {}
+    for name in table.get_function_names():
+        fcns = sorted(table.lookup_by_name(name), key=lambda f: f.address)
+        for (n, f) in enumerate(fcns):
+            keyed[(name, n)] = f
+    return keyed
+
+
+def display_name(key):
+    (name, n) = key
+    return name if n == 0 else '%s (#%d)' % (name, n + 1)
+
+
+class GraphDiff:
+    def __init__(self, old, new, entry_points=()):
+        self.old = old
+        self.new = new
+        old_fcns = functions_by_key(old)
+        new_fcns = functions_by_key(new)
+        self.added = [k for k in new_fcns if k not in old_fcns]
+        self.removed = [k for k in old_fcns if k not in new_fcns]
+        self.changed = []
+        for key in new_fcns:
+            if key in old_fcns and self.code_changed(old_fcns[key], new_fcns[key]):
+                self.changed.append(key)
+
+        old_keys = dict((id(f), k) for (k, f) in old_fcns.items())
+        new_keys = dict((id(f), k) for (k, f) in new_fcns.items())
+        self.new_edges = []
+        self.removed_edges = []
+        for key in self.added + self.changed:
+            callees = set(new_keys[id(c)] for c in new_fcns[key].callees)
+            old_callees = set()
+            if key in old_fcns:
+                old_callees = set(old_keys[id(c)] for c in old_fcns[key].callees)
+            self.new_edges.extend((key, c) for c in sorted(callees - old_callees))
+            self.removed_edges.extend((key, c) for c in sorted(old_callees - callees))
+        for key in self.removed:
+            self.removed_edges.extend((key, old_keys[id(c)]) for c in old_fcns[key].callees)
+
+        self.reachability = []
+        if entry_points:
+            old_index = ReachabilityIndex(old.graph)
+            new_index = ReachabilityIndex(new.graph)
+            for name in entry_points:
+                before = self.reachable(old, old_index, old_keys, name)
+                after = self.reachable(new, new_index, new_keys, name)
+                self.reachability.append((name, sorted(after - before), sorted(before - after)))
+
+    def code_changed(self, old_fcn, new_fcn):
+        old_hash = self.old.code_hashes.get(old_fcn.address)
+        new_hash = self.new.code_hashes.get(new_fcn.address)
+        if old_hash is not None and new_hash is not None:
+            return old_hash != new_hash
+        # Without hashes, fall back to comparing the callees by name.
+        return sorted(c.name for c in old_fcn.callees) != sorted(c.name for c in new_fcn.callees)
+
+    def reachable(self, table, index, keys, name):
+        ids = [table.graph.node_id(f.address) for f in table.lookup_by_name(name)]
+        return set(keys[id(table.graph.nodes[i])] for i in index.reachable_from(ids))
+
+    def report(self, writer, describe=display_name):
+        sections = [('Added functions', '+', [describe(k) for k in self.added]),
+                    ('Removed functions', '-', [describe(k) for k in self.removed]),
+                    ('Changed functions', '~', [describe(k) for k in self.changed]),
+                    ('New call edges', '+', ['%s -> %s' % (describe(a), describe(b))
+                                             for (a, b) in self.new_edges]),
+                    ('Removed call edges', '-', ['%s -> %s' % (describe(a), describe(b))
+                                                 for (a, b) in self.removed_edges])]
+        for (name, added, removed) in self.reachability:
+            sections.append(('Reachability changes from %s' % name, None,
+                             ['+ %s' % describe(k) for k in added] +
+                             ['- %s' % describe(k) for k in removed]))
+        for (title, sign, lines) in sections:
+            writer.write('%s (%d):' % (title, len(lines)))
+            for line in lines:
+                writer.write('  %s %s' % (sign, line) if sign else '  %s' % line)
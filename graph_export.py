@@ -0,0 +1,195 @@
+import json
+import struct
+import sys
+from array import array
+from collections import deque
+from xml.sax.saxutils import escape, quoteattr
+
+# Writes a call graph, or part of one, for other tools to read. Nodes are
+# functions with callers and callees lists, told apart by identity;
+# attributes(fcn) returns the (key, value) pairs exported for a node, and
+# edge_attributes(caller, callee), if given, those of an edge. Node ids are
+# positions in the node list. Everything is written as it is generated
+# through a buffered file, so apart from the node id map memory use does
+# not grow with the graph.
+#
+# Formats:
+#   jsonl    one JSON object per line, nodes then edges:
+#            {"type": "node", "id": 0, "name": ...}
+#            {"type": "edge", "source": 0, "target": 1}
+#   dot      Graphviz digraph
+#   graphml  GraphML with one data key per attribute
+#   csr      the binary layout below, little endian; edge attributes are
+#            not written
+
+FORMATS = ['jsonl', 'dot', 'graphml', 'csr']
+EXTENSIONS = {'.jsonl': 'jsonl', '.json': 'jsonl', '.dot': 'dot', '.gv': 'dot',
+              '.graphml': 'graphml', '.csr': 'csr'}
+
+# csr layout:
+#   header          magic, format version, node count, edge count
+#   edge offsets    Q[nodes + 1]  rows into edge targets, by caller
+#   edge targets    I[edges]      callee node ids
+#   name offsets    Q[nodes + 1]
+#   names           utf-8 blob
+CSR_MAGIC = b'ENCX'
+CSR_VERSION = 1
+CSR_HEADER = struct.Struct('<4sIQQ')
+BATCH = 4096
+BUFFER_SIZE = 1 << 20
+
+
+def caller_subgraph(roots, depth):
+    # roots and every function within depth calls above them.
+    seen = set(id(f) for f in roots)
+    nodes = list(roots)
+    queue = deque((f, 0) for f in roots)
+    while queue:
+        (fcn, d) = queue.popleft()
+        if d == depth:
+            continue
+        for caller in fcn.callers:
+            if id(caller) not in seen:
+                seen.add(id(caller))
+                nodes.append(caller)
+                queue.append((caller, d + 1))
+    return nodes
+
+
+class GraphExport:
+    def __init__(self, nodes, attributes, edge_attributes=None):
+        self.nodes = nodes
+        self.attributes = attributes
+        self.edge_attributes = edge_attributes
+        self.ids = {}
+        for (i, fcn) in enumerate(nodes):
+            self.ids[id(fcn)] = i
+
+    def edges(self):
+        # (caller id, callee id) pairs, grouped by caller.
+        for (i, fcn) in enumerate(self.nodes):
+            for callee in fcn.callees:
+                j = self.ids.get(id(callee))
+                if j is not None:
+                    yield (i, j)
+
+    def edge_attribute_pairs(self, i, j):
+        if self.edge_attributes is None:
+            return []
+        return self.edge_attributes(self.nodes[i], self.nodes[j])
+
+    def write_jsonl(self, out):
+        for (i, fcn) in enumerate(self.nodes):
+            record = {'type': 'node', 'id': i}
+            record.update(self.attributes(fcn))
+            out.write(json.dumps(record))
+            out.write('\n')
+        for (i, j) in self.edges():
+            if self.edge_attributes is None:
+                out.write('{"type": "edge", "source": %d, "target": %d}\n' % (i, j))
+                continue
+            record = {'type': 'edge', 'source': i, 'target': j}
+            record.update(self.edge_attribute_pairs(i, j))
+            out.write(json.dumps(record))
+            out.write('\n')
+
+    def write_dot(self, out):
+        out.write('digraph callgraph {\n')
+        for (i, fcn) in enumerate(self.nodes):
+            attrs = ''.join(', %s=%s' % (key, json.dumps(str(value)))
+                            for (key, value) in self.attributes(fcn)
+                            if key != 'name' and value is not None)
+            out.write('  n%d [label=%s%s];\n' % (i, json.dumps(fcn.name), attrs))
+        for (i, j) in self.edges():
+            attrs = ', '.join('%s=%s' % (key, json.dumps(str(value)))
+                              for (key, value) in self.edge_attribute_pairs(i, j)
+                              if value is not None)
+            out.write('  n%d -> n%d%s;\n' % (i, j, ' [%s]' % attrs if attrs else ''))
+        out.write('}\n')
+
+    def write_graphml(self, out):
+        keys = []
+        for fcn in self.nodes[:1]:
+            keys = [key for (key, value) in self.attributes(fcn)]
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        edge_keys = []
+        for (i, j) in self.edges():
+            edge_keys = [key for (key, value) in self.edge_attribute_pairs(i, j)]
+            break
+        for key in keys:
+            out.write('  <key id=%s for="node" attr.name=%s attr.type="string"/>\n'
+                      % (quoteattr(key), quoteattr(key)))
+        for key in edge_keys:
+            out.write('  <key id=%s for="edge" attr.name=%s attr.type="string"/>\n'
+                      % (quoteattr('edge-' + key), quoteattr(key)))
+        out.write('  <graph id="callgraph" edgedefault="directed">\n')
+        for (i, fcn) in enumerate(self.nodes):
+            out.write('    <node id="n%d">' % i)
+            for (key, value) in self.attributes(fcn):
+                if value is not None:
+                    out.write('<data key=%s>%s</data>' % (quoteattr(key), escape(str(value))))
+            out.write('</node>\n')
+        for (i, j) in self.edges():
+            data = ''.join('<data key=%s>%s</data>' % (quoteattr('edge-' + key), escape(str(value)))
+                           for (key, value) in self.edge_attribute_pairs(i, j)
+                           if value is not None)
+            if data:
+                out.write('    <edge source="n%d" target="n%d">%s</edge>\n' % (i, j, data))
+            else:
+                out.write('    <edge source="n%d" target="n%d"/>\n' % (i, j))
+        out.write('  </graph>\n</graphml>\n')
+
+    def write_array(self, out, typecode, values):
+        batch = array(typecode)
+        for value in values:
+            batch.append(value)
+            if len(batch) == BATCH:
+                out.write(batch.tobytes())
+                del batch[:]
+        out.write(batch.tobytes())
+
+    def write_csr(self, out):
+        edges = sum(1 for e in self.edges())
+        out.write(CSR_HEADER.pack(CSR_MAGIC, CSR_VERSION, len(self.nodes), edges))
+
+        def edge_offsets():
+            total = 0
+            yield 0
+            for fcn in self.nodes:
+                total += sum(1 for callee in fcn.callees if id(callee) in self.ids)
+                yield total
+        self.write_array(out, 'Q', edge_offsets())
+        self.write_array(out, 'I', (j for (i, j) in self.edges()))
+
+        def name_offsets():
+            total = 0
+            yield 0
+            for fcn in self.nodes:
+                total += len(fcn.name.encode('utf-8'))
+                yield total
+        self.write_array(out, 'Q', name_offsets())
+        for fcn in self.nodes:
+            out.write(fcn.name.encode('utf-8'))
+
+    def write(self, filename, fmt=None):
+        fmt = fmt or export_format(filename)
+        binary = fmt == 'csr'
+        if filename == '-':
+            out = sys.stdout.buffer if binary else sys.stdout
+            getattr(self, 'write_' + fmt)(out)
+            out.flush()
+            return
+        if binary:
+            out = open(filename, 'wb', buffering=BUFFER_SIZE)
+        else:
+            out = open(filename, 'w', buffering=BUFFER_SIZE, encoding='utf-8')
+        with out:
+            getattr(self, 'write_' + fmt)(out)
+
+
+def export_format(filename):
+    for (extension, fmt) in EXTENSIONS.items():
+        if filename.endswith(extension):
+            return fmt
+    return 'jsonl'
@@ -1,18 +1,57 @@
 import subprocess
 import re
 import shutil
-from utility import Function, FunctionTable, get_locations_table_through_nm
+import stats
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dwarf_lines import open_line_table
+from utility import CHUNKS_PER_JOB, Function, FunctionTable, get_locations_table_through_nm, \
+    link_call_edges, map_chunks, split_chunks
+
+
+def parse_chunk(chunk, separator, patterns, show_symbol_files):
+    # Runs in a worker process. Returns (name, location) records of the
+    # function listings in chunk, and flat call edges whose callers are
+    # indexes into the records.
+    with stats.phase('regex'):
+        (header_re, location_re, callstmt) = [re.compile(p) for p in patterns]
+        records = []
+        call_edges = array('Q')
+        for listing in chunk.split(separator):
+            details = header_re.match(listing)
+            if not details:
+                continue
+            loc = []
+            if show_symbol_files:
+                lm = location_re.match(listing)
+                if lm:
+                    loc = lm[2]
+            for callee in callstmt.findall(listing):
+                call_edges.append(len(records))
+                call_edges.append(int(callee[0], 16) + int(callee[1], 10) + 5)
+            records.append((details[1], loc))
+    return (records, call_edges)
+
 
 class LLVMObjDumpParser():
-    def __init__(self, binary_file_name, show_symbol_files):
+    tool = 'llvm-objdump'
+
+    def __init__(self, binary_file_name, show_symbol_files, keep_code=True, jobs=1):
         self.binary_file_name = binary_file_name
         self.show_symbol_files = show_symbol_files
+        # With more than one job the listing is cut into chunks at function
+        # boundaries and parsed in a process pool, without keeping the code.
+        self.jobs = jobs
+        self.keep_code = keep_code and jobs == 1
+        self.call_edges = array('Q')
         self.nm_available = False
         self.symbol_to_address_dict= {}
         self.functions_table = FunctionTable()
+        if show_symbol_files:
+            self.functions_table.locator = open_line_table(binary_file_name)
 
-        if shutil.which("nm") is not None:
-            self.nm_available = True
+        if shutil.which("nm") is not None or self.functions_table.locator is not None:
+            self.nm_available = shutil.which("nm") is not None
             self.command_args = ['llvm-objdump', '-d',self.binary_file_name]
         else:
             self.command_args = ['llvm-objdump', '-d', '-l', self.binary_file_name]
@@ -24,11 +63,31 @@ class LLVMObjDumpParser():
         self.symbol_location_extraction_pattern  = '(\S+):\n; (.+:\d+)\n'
         self.calls_statement_matching_pattern   =  '\s*([a-fA-F0-9]+):.+callq\s+(-*\d+)\s+<(.+)>'
         
-        self.construct_symbols_to_address_dict()
-        self.construct_functions_table()
+        with stats.phase('regex'), ThreadPoolExecutor(max_workers=2) as executor:
+            # The symbol table and nm -l are read while llvm-objdump
+            # disassembles.
+            symbols = executor.submit(self.run_tool, self.symbol_table_args)
+            locations = None
+            if self.show_symbol_files and self.nm_available and self.functions_table.locator is None:
+                locations = executor.submit(get_locations_table_through_nm, self.binary_file_name)
+            elf_output = self.run_tool(self.command_args)
+            self.construct_symbols_to_address_dict(symbols.result())
+            loc_table = locations.result() if locations else None
+            if self.jobs > 1:
+                self.construct_functions_table_parallel(elf_output, loc_table)
+            else:
+                self.construct_functions_table(elf_output, loc_table)
+
+    def run_tool(self, args):
+        with stats.phase('tool'):
+            return subprocess.check_output(args, encoding='utf-8')
+
+    def split_listing(self, elf_output):
+        with stats.phase('split'):
+            elf_output = elf_output.replace("Disassembly of section .text:", "Disassembly of section .text:\n")
+            return elf_output.split(self.functions_code_seperator)
 
-    def construct_symbols_to_address_dict(self):
-        symbols_output = subprocess.check_output(self.symbol_table_args, encoding='utf-8')
+    def construct_symbols_to_address_dict(self, symbols_output):
         symbols_output_lines = symbols_output.split("\n")
         symbols_extraction_matcher = re.compile(self.address_extraction_pattern)
 
@@ -40,18 +99,13 @@ class LLVMObjDumpParser():
         
         return
 
-    def construct_functions_table(self):
+    def construct_functions_table(self, elf_output, loc_table=None):
         
-        elf_output = subprocess.check_output(self.command_args, encoding='utf-8')
-        elf_output = elf_output.replace("Disassembly of section .text:", "Disassembly of section .text:\n")
-        fcn_listings = elf_output.split(self.functions_code_seperator)
-
-        loc_table = None
-        if self.show_symbol_files and self.nm_available:
-            loc_table = get_locations_table_through_nm(self.binary_file_name)
+        fcn_listings = self.split_listing(elf_output)
 
         header_re   = re.compile(self.functions_name_extractor_pattern)
         location_re = re.compile(self.symbol_location_extraction_pattern)
+        callstmt    = re.compile(self.calls_statement_matching_pattern)
 
         for listing in fcn_listings:
             details = header_re.match(listing)
@@ -70,35 +124,63 @@ class LLVMObjDumpParser():
                     if lm:
                         loc = lm[2]
 
+            code = listing
+            if not self.keep_code:
+                # Keep only the call edges.
+                self.extract_call_edges(address, listing, callstmt)
+                code = None
+
             f = Function(name=function_name,
                         location=loc,
                         address=address, # Convert to hex for look up
-                        code=listing,
+                        code=code,
                         callees=[],
                         callers=[])
             self.functions_table.add(f)
         return
 
+    def construct_functions_table_parallel(self, elf_output, loc_table=None):
+        with stats.phase('split'):
+            elf_output = elf_output.replace("Disassembly of section .text:", "Disassembly of section .text:\n")
+            chunks = split_chunks(elf_output, self.functions_code_seperator,
+                                  self.jobs * CHUNKS_PER_JOB)
+        del elf_output
+
+        patterns = (self.functions_name_extractor_pattern,
+                    self.symbol_location_extraction_pattern,
+                    self.calls_statement_matching_pattern)
+        for (records, call_edges) in map_chunks(parse_chunk, chunks, self.jobs,
+                                                self.functions_code_seperator, patterns,
+                                                self.show_symbol_files):
+            addresses = []
+            for (function_name, loc) in records:
+                address = self.symbol_to_address_dict[function_name]
+                if loc_table and address in loc_table:
+                    loc = loc_table[address]
+                addresses.append(address)
+                self.functions_table.add(Function(name=function_name,
+                                                  location=loc,
+                                                  address=address,
+                                                  code=None,
+                                                  callees=[],
+                                                  callers=[]))
+            for idx in range(0, len(call_edges), 2):
+                self.call_edges.append(addresses[call_edges[idx]])
+                self.call_edges.append(call_edges[idx + 1])
+
+    def extract_call_edges(self, address, listing, callstmt):
+        for callee in callstmt.findall(listing):
+            self.call_edges.append(address)
+            self.call_edges.append(int(callee[0], 16) + int(callee[1], 10) + 5)
+
     def analyze(self):
         # Consider both calls and jmps as calls.
         callstmt = re.compile(self.calls_statement_matching_pattern)
 
-        for fcn in self.functions_table.functions():
-            callstmt = re.compile(self.calls_statement_matching_pattern)
-            callees = callstmt.findall(fcn.code)
+        with stats.phase('regex'):
+            for fcn in self.functions_table.functions():
+                if fcn.code is None:
+                    continue
+                self.extract_call_edges(fcn.address, fcn.code, callstmt)
 
-            if len(callees) == 0:
-                continue
-            
-            else:
-                for callee in callees:
-                    callee_address = int(callee[0], 16) + int(callee[1], 10) + 5
-                    try:
-                        callee_fcn = self.functions_table.lookup(callee_address)
-                        if callee_fcn not in fcn.callees:
-                            fcn.callees.append(callee_fcn)
-                        if fcn not in callee_fcn.callers:
-                            callee_fcn.callers.append(fcn)
-                    except:
-                        #print('Could not resolve callee %s %s' % (callee_address, callee_name))
-                        pass
+        link_call_edges(self.functions_table, self.call_edges)
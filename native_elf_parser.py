@@ -0,0 +1,92 @@
+import shutil
+import stats
+from array import array
+from dwarf_lines import LineTable
+from elf_file import ElfFile
+from reference_index import ReferenceIndex
+from utility import Function, FunctionTable, demangle, get_locations_table_through_nm, link_call_edges
+from x86_decoder import CALL, JMP, LEA, decode_references
+
+EDGE_KINDS = (CALL, JMP, LEA)
+
+class NativeElfParser():
+    # Reads symbols and code straight from the ELF file instead of parsing
+    # objdump output. Calls and jumps are found with a built-in x86-64
+    # decoder.
+    tool = None
+    version = '1'
+
+    def __init__(self, binary_file_name, show_symbol_files, disassemble=True):
+        self.binary_file_name = binary_file_name
+        self.show_symbol_files = show_symbol_files
+        # Without disassembly only the symbol table is read; edges come from
+        # elsewhere (see relocations.py).
+        self.disassemble = disassemble
+        self.functions_table = FunctionTable()
+        # Flat (caller, callee) address pairs extracted while parsing.
+        self.call_edges = array('Q')
+        # Address and size of the code of each function.
+        self.extents = {}
+        self.nm_available = shutil.which("nm") is not None
+        self.elf = ElfFile(binary_file_name)
+
+        with stats.phase('decode'):
+            self.construct_functions_table()
+
+    def construct_functions_table(self):
+        symbols = self.elf.function_symbols()
+        names = demangle([sym.name for sym in symbols])
+
+        loc_table = None
+        if self.show_symbol_files and self.elf.section('.debug_line') is not None:
+            self.functions_table.locator = LineTable(self.elf)
+        elif self.show_symbol_files and self.nm_available:
+            loc_table = get_locations_table_through_nm(self.binary_file_name)
+
+        for (sym, name) in zip(symbols, names):
+            section = self.elf.sections[sym.section_index]
+            self.extents[sym.value] = (section, sym.size)
+            if self.disassemble:
+                code = self.elf.read_at(section, sym.value, sym.size)
+                for (kind, target) in decode_references(code, sym.value):
+                    if kind in EDGE_KINDS:
+                        self.call_edges.append(sym.value)
+                        self.call_edges.append(target)
+
+            loc = []
+            if loc_table and sym.value in loc_table:
+                loc = loc_table[sym.value]
+
+            f = Function(name=name,
+                        location=loc,
+                        address=sym.value,
+                        code=None,
+                        callees=[],
+                        callers=[])
+            self.functions_table.add(f)
+            if sym.name != name:
+                self.functions_table.add_alias(sym.name, name)
+        return
+
+    def analyze(self):
+        link_call_edges(self.functions_table, self.call_edges)
+
+    def analyze_callers(self, roots, depth):
+        # Instead of analyze() on a parser built without disassembly: links
+        # only the calls into functions that can reach roots within depth
+        # calls, and those one call further, so that a caller tree cut off at
+        # depth still shows that it goes on. The functions are found with a
+        # ReferenceIndex, and only they are decoded.
+        with stats.phase('scan'):
+            index = ReferenceIndex(self.elf, self.extents)
+            candidates = index.callers_within([f.address for f in roots], depth + 1)
+        stats.record('decoded-functions', len(candidates))
+        with stats.phase('decode'):
+            for address in sorted(candidates):
+                (section, size) = self.extents[address]
+                code = self.elf.read_at(section, address, size)
+                for (kind, target) in decode_references(code, address):
+                    if kind in EDGE_KINDS and target in candidates:
+                        self.call_edges.append(address)
+                        self.call_edges.append(target)
+        link_call_edges(self.functions_table, self.call_edges)
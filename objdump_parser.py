@@ -1,18 +1,59 @@
 import subprocess
 import re
 import shutil
-from utility import Function, FunctionTable, get_locations_table_through_nm
+import stats
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dwarf_lines import open_line_table
+from utility import CHUNKS_PER_JOB, Function, FunctionTable, get_locations_table_through_nm, \
+    link_call_edges, map_chunks, split_chunks, stream_chunks
+
+
+def parse_chunk(chunk, separator, patterns, show_symbol_files):
+    # Runs in a worker process. Returns (name, address, location) records
+    # and the flat call edges of the function listings in chunk.
+    with stats.phase('regex'):
+        (header_re, location_re, callstmt, leastmt) = [re.compile(p) for p in patterns]
+        records = []
+        call_edges = array('Q')
+        for listing in chunk.split(separator):
+            m = header_re.match(listing)
+            if not m:
+                continue
+            address = int(m[1], 16)
+            loc = []
+            if show_symbol_files:
+                lm = location_re.match(listing)
+                if lm:
+                    loc = lm[1]
+            records.append((m[2], address, loc))
+            for c in callstmt.findall(listing) + leastmt.findall(listing):
+                call_edges.append(address)
+                call_edges.append(int(c[1], 16))
+    return (records, call_edges)
+
 
 class ObjDumpParser():
+    tool = 'objdump'
 
-    def __init__(self, binary_file_name, show_symbol_files):
+    def __init__(self, binary_file_name, show_symbol_files, streaming=False, keep_code=True,
+                 jobs=1):
         self.binary_file_name = binary_file_name
         self.show_symbol_files = show_symbol_files
+        self.streaming = streaming
+        # With more than one job the listing is cut into chunks at function
+        # boundaries and parsed in a process pool.
+        self.jobs = jobs
+        # Streaming and parallel parsing never hold on to the listing text.
+        self.keep_code = keep_code and not streaming and jobs == 1
         self.functions_table = FunctionTable()
+        self.call_edges = array('Q')
         self.nm_available = False
+        if show_symbol_files:
+            self.functions_table.locator = open_line_table(binary_file_name)
         
-        if shutil.which("nm") is not None:
-            self.nm_available = True
+        if shutil.which("nm") is not None or self.functions_table.locator is not None:
+            self.nm_available = shutil.which("nm") is not None
             self.command_args = ['objdump', '-C', '-d', self.binary_file_name]
         else:
             self.command_args = ['objdump','-C', '-d', '-l', self.binary_file_name]
@@ -23,70 +64,163 @@ class ObjDumpParser():
         self.calls_statement_matching_pattern       =  '(callq|jmpq)\s+(\S+)\s+<(.+)>'
         self.leas_statement_matching_pattern        = '(lea)\s+.+# (\S+)\s+<(.+)>\s*'
 
-        self.construct_functions_table()
+        with stats.phase('regex'):
+            if self.streaming:
+                self.construct_functions_table_streaming()
+            elif self.jobs > 1:
+                self.construct_functions_table_parallel()
+            else:
+                self.construct_functions_table()
     
+    def run_tool(self, args):
+        with stats.phase('tool'):
+            return subprocess.check_output(args, encoding='utf-8')
+
+    def split_listing(self, elf_output):
+        with stats.phase('split'):
+            return elf_output.split(self.functions_code_seperator)
+
+    def start_locations(self, executor):
+        # Runs nm -l in the background when locations come from it, so that
+        # it overlaps objdump. Returns a future of the table, or None.
+        if self.show_symbol_files and self.nm_available and self.functions_table.locator is None:
+            return executor.submit(get_locations_table_through_nm, self.binary_file_name)
+        return None
+
     def construct_functions_table(self):
         
-        elf_ouput = subprocess.check_output(self.command_args, encoding='utf-8')
-        fcn_listings = elf_ouput.split(self.functions_code_seperator)
-
-        loc_table = None
-        if self.show_symbol_files and self.nm_available:
-            loc_table = get_locations_table_through_nm(self.binary_file_name)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            locations = self.start_locations(executor)
+            elf_ouput = self.run_tool(self.command_args)
+            fcn_listings = self.split_listing(elf_ouput)
+            loc_table = locations.result() if locations else None
 
         header_re   = re.compile(self.functions_name_extractor_pattern)
         location_re = re.compile(self.symbol_location_extraction_pattern)
+        callstmt    = re.compile(self.calls_statement_matching_pattern)
+        leastmt     = re.compile(self.leas_statement_matching_pattern)
 
         for listing in fcn_listings:
-            m = header_re.match(listing)
-            # Check if it is indeed a function
-            if not m:
-                continue
-            
-            address = int(m[1], 16)
-            loc = []
-            if self.show_symbol_files:
+            self.add_function(listing, loc_table, header_re, location_re,
+                              callstmt, leastmt)
+        return
+
+    def construct_functions_table_parallel(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            locations = self.start_locations(executor)
+            elf_output = self.run_tool(self.command_args)
+            with stats.phase('split'):
+                chunks = split_chunks(elf_output, self.functions_code_seperator,
+                                      self.jobs * CHUNKS_PER_JOB)
+            del elf_output
+            self.parse_chunks(chunks, locations)
+
+    def construct_functions_table_streaming(self):
+        # Parse objdump's output while it is still being written instead of
+        # buffering the whole listing.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            locations = self.start_locations(executor)
+            with subprocess.Popen(self.command_args, stdout=subprocess.PIPE,
+                                  encoding='utf-8') as proc:
+                if self.jobs > 1:
+                    self.parse_chunks(stream_chunks(proc.stdout), locations)
+                else:
+                    self.parse_listing_stream(proc.stdout)
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, self.command_args)
+            if locations and self.jobs == 1:
+                self.functions_table.fill_locations(locations.result() or {})
+
+    def parse_chunks(self, chunks, locations=None):
+        # Parses chunks of the listing in a process pool and adds the records
+        # in listing order. locations is a future of the nm table.
+        patterns = (self.functions_name_extractor_pattern,
+                    self.symbol_location_extraction_pattern,
+                    self.calls_statement_matching_pattern,
+                    self.leas_statement_matching_pattern)
+        loc_table = None
+        for (records, call_edges) in map_chunks(parse_chunk, chunks, self.jobs,
+                                                self.functions_code_seperator, patterns,
+                                                self.show_symbol_files):
+            if locations and loc_table is None:
+                loc_table = locations.result() or {}
+            for (name, address, loc) in records:
                 if loc_table and address in loc_table:
                     loc = loc_table[address]
-                else:
-                    lm = location_re.match(listing)
-                    if lm:
-                        loc = lm[1]
-
-            f = Function(name=m[2],
-                        location=loc,
-                        address=int(m[1], 16), # Convert to hex for look up
-                        code=listing,
-                        callees=[],
-                        callers=[])
-            self.functions_table.add(f)
-        return
+                self.functions_table.add(Function(name=name,
+                                                  location=loc,
+                                                  address=address,
+                                                  code=None,
+                                                  callees=[],
+                                                  callers=[]))
+            self.call_edges.extend(call_edges)
+
+    def parse_listing_stream(self, lines, loc_table=None):
+        header_re   = re.compile(self.functions_name_extractor_pattern)
+        location_re = re.compile(self.symbol_location_extraction_pattern)
+        callstmt    = re.compile(self.calls_statement_matching_pattern)
+        leastmt     = re.compile(self.leas_statement_matching_pattern)
+
+        # Only the lines of the function currently being read are held in
+        # memory. Function boundaries are blank lines, as in the buffered mode.
+        block = []
+        for line in lines:
+            if line.strip('\n'):
+                block.append(line)
+                continue
+            if block:
+                self.add_function(''.join(block), loc_table, header_re,
+                                  location_re, callstmt, leastmt)
+                block = []
+        if block:
+            self.add_function(''.join(block), loc_table, header_re,
+                              location_re, callstmt, leastmt)
+
+    def add_function(self, listing, loc_table, header_re, location_re,
+                     callstmt, leastmt):
+        m = header_re.match(listing)
+        # Check if it is indeed a function
+        if not m:
+            return
+
+        address = int(m[1], 16)
+        loc = []
+        if self.show_symbol_files:
+            if loc_table and address in loc_table:
+                loc = loc_table[address]
+            else:
+                lm = location_re.match(listing)
+                if lm:
+                    loc = lm[1]
+
+        code = listing
+        if not self.keep_code:
+            # Keep only the call edges.
+            for c in callstmt.findall(listing) + leastmt.findall(listing):
+                self.call_edges.append(address)
+                self.call_edges.append(int(c[1], 16))
+            code = None
+
+        f = Function(name=m[2],
+                    location=loc,
+                    address=address,
+                    code=code,
+                    callees=[],
+                    callers=[])
+        self.functions_table.add(f)
 
     def analyze(self):
         # Consider both calls and jmps as calls.
         callstmt = re.compile(self.calls_statement_matching_pattern)
         leastmt = re.compile(self.leas_statement_matching_pattern) 
 
-        for fcn in self.functions_table.functions():
-            callees = callstmt.findall(fcn.code) + leastmt.findall(fcn.code)
-            if len(callees) == 0:
-                #print('%s %s calls []' % (hex(fcn.address), fcn.name))
-                continue
-
-            #print('%s %s calls' % (hex(fcn.address), fcn.name))
-            for c in callees:
-                # Avoid recursive calls.
-                if c == fcn:
+        with stats.phase('regex'):
+            for fcn in self.functions_table.functions():
+                if fcn.code is None:
                     continue
-                callee_address = int(c[1], 16)
-                callee_name = c[2]
-                #print('    %s %s' % (hex(callee_address), callee_name))
-                try:
-                    callee_fcn = self.functions_table.lookup(callee_address)
-                    if callee_fcn not in fcn.callees:
-                        fcn.callees.append(callee_fcn)
-                    if fcn not in callee_fcn.callers:
-                        callee_fcn.callers.append(fcn)
-                except:
-                    #print('Could not resolve callee %s %s' % (callee_address, callee_name))
-                    pass
+                callees = callstmt.findall(fcn.code) + leastmt.findall(fcn.code)
+                for c in callees:
+                    self.call_edges.append(fcn.address)
+                    self.call_edges.append(int(c[1], 16))
+
+        link_call_edges(self.functions_table, self.call_edges)
@@ -0,0 +1,166 @@
+from collections import deque, namedtuple
+from walker import print_callers
+
+# Call paths between functions. A path is a list of functions, each
+# calling the next. Functions need callers and callees lists and are told
+# apart by identity.
+
+PathNode = namedtuple('PathNode', 'function callers')
+
+
+def path_to(meeting, forward, backward):
+    # Joins the two halves of a bidirectional search at meeting.
+    path = []
+    fcn = meeting
+    while fcn is not None:
+        path.append(fcn)
+        fcn = forward[id(fcn)]
+    path.reverse()
+    fcn = backward[id(meeting)]
+    while fcn is not None:
+        path.append(fcn)
+        fcn = backward[id(fcn)]
+    return path
+
+
+def shortest_path(sources, targets, max_length=None):
+    # Bidirectional breadth first search, expanding the smaller frontier
+    # first. Returns a shortest path from any source to any target, or None.
+    forward = dict((id(f), None) for f in sources)
+    backward = dict((id(f), None) for f in targets)
+    for f in sources:
+        if id(f) in backward:
+            return [f]
+    forward_frontier = list(sources)
+    backward_frontier = list(targets)
+    length = 0
+    while forward_frontier and backward_frontier:
+        if max_length is not None and length >= max_length:
+            return None
+        length += 1
+        if len(forward_frontier) <= len(backward_frontier):
+            (frontier, parents, others, attr) = (forward_frontier, forward, backward, 'callees')
+        else:
+            (frontier, parents, others, attr) = (backward_frontier, backward, forward, 'callers')
+        following = []
+        for fcn in frontier:
+            for nxt in getattr(fcn, attr):
+                if id(nxt) in parents:
+                    continue
+                parents[id(nxt)] = fcn
+                if id(nxt) in others:
+                    return path_to(nxt, forward, backward)
+                following.append(nxt)
+        if parents is forward:
+            forward_frontier = following
+        else:
+            backward_frontier = following
+    return None
+
+
+def distances_to(targets, max_length):
+    # Number of calls from each function to the nearest target.
+    distance = dict((id(f), 0) for f in targets)
+    queue = deque(targets)
+    while queue:
+        fcn = queue.popleft()
+        d = distance[id(fcn)]
+        if d == max_length:
+            continue
+        for caller in fcn.callers:
+            if id(caller) not in distance:
+                distance[id(caller)] = d + 1
+                queue.append(caller)
+    return distance
+
+
+def simple_paths(sources, targets, limit=None, max_length=None):
+    # Yields up to limit simple paths from sources to targets with at most
+    # max_length calls, shortest first. Functions already on a path are not
+    # entered again, so cycles are followed at most once.
+    if max_length is None:
+        max_length = len(distances_to(targets, None))
+    distance = distances_to(targets, max_length)
+    targets = set(id(f) for f in targets)
+    count = 0
+    for length in range(max_length + 1):
+        for source in sources:
+            if distance.get(id(source), length + 1) > length:
+                continue
+            if length > 0 and id(source) in targets:
+                continue
+            path = [source]
+            on_path = set([id(source)])
+            # Depth first search for paths of exactly length calls. A
+            # function is entered only if a target is still in reach.
+            stack = [iter(source.callees)]
+            while stack:
+                if len(path) - 1 == length:
+                    if id(path[-1]) in targets:
+                        yield list(path)
+                        count += 1
+                        if limit is not None and count == limit:
+                            return
+                    stack.pop()
+                    on_path.discard(id(path.pop()))
+                    continue
+                remaining = length - len(path)
+                for nxt in stack[-1]:
+                    if id(nxt) in on_path or distance.get(id(nxt), remaining + 1) > remaining:
+                        continue
+                    # Paths end at the first target they reach.
+                    if remaining > 0 and id(nxt) in targets:
+                        continue
+                    path.append(nxt)
+                    on_path.add(id(nxt))
+                    stack.append(iter(nxt.callees))
+                    break
+                else:
+                    stack.pop()
+                    on_path.discard(id(path.pop()))
+
+
+def find_paths(sources, targets, limit=1, max_length=None):
+    if limit == 1:
+        path = shortest_path(sources, targets, max_length)
+        return [path] if path else []
+    return list(simple_paths(sources, targets, limit, max_length))
+
+
+def path_tree(paths):
+    # Merges paths into trees rooted at their targets, in the shape of a
+    # caller tree: each node's callers lead back towards the sources.
+    roots = []
+    for path in paths:
+        level = roots
+        for fcn in reversed(path):
+            for node in level:
+                if node.function is fcn:
+                    break
+            else:
+                node = PathNode(function=fcn, callers=[])
+                level.append(node)
+            level = node.callers
+    return roots
+
+
+def print_paths(paths, describe, mark, writer):
+    depth = max(len(path) for path in paths) if paths else 0
+    for root in path_tree(paths):
+        print_callers(root, depth, lambda node: describe(node.function), mark, writer)
+
+
+def print_call_paths(lookup, source, target, count, depth, describe, mark, writer):
+    # Prints up to count paths of at most depth calls from the functions
+    # named source to those named target.
+    sources = lookup(source)
+    targets = lookup(target)
+    for (name, fcns) in [(source, sources), (target, targets)]:
+        if not fcns:
+            writer.write('Function %s not found' % name)
+    if not sources or not targets:
+        return
+    paths = find_paths(sources, targets, count, depth)
+    if not paths:
+        writer.write('No path from %s to %s within %d calls' % (source, target, depth))
+    print_paths(paths, describe, mark, writer)
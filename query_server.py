@@ -0,0 +1,215 @@
+import json
+import os
+import socketserver
+import sys
+import threading
+from collections import deque
+from paths import find_paths, shortest_path
+
+# Answers call graph queries over JSON lines, so that a graph is analyzed
+# once and then queried many times. Every request is a JSON object on one
+# line, and every response is a JSON object on one line:
+#
+#   {"query": "callers-of", "name": "oe_abort", "depth": 2}
+#   {"query": "callees-of", "name": "main"}
+#   {"query": "paths-between", "source": "main", "target": "oe_abort",
+#    "limit": 5, "max-length": 12}
+#   {"query": "reachability", "source": "main", "target": "oe_abort"}
+#   {"query": "reachability", "source": "main"}
+#   {"query": "reachability", "target": "oe_abort"}
+#   {"query": "shutdown"}
+#
+# An "id" in a request is copied to its response. Failed requests get an
+# "error" member instead of a result.
+
+QUERIES = ['callers-of', 'callees-of', 'paths-between', 'reachability', 'shutdown']
+
+
+class QueryError(Exception):
+    pass
+
+
+class QueryEngine:
+    # lookup(name) returns the functions with that name, and describe(fcn)
+    # returns a JSON-compatible dict for one function. Functions need
+    # callers and callees lists. reachability, a
+    # reachability.GraphReachability, answers reachability queries without
+    # walking the graph.
+    def __init__(self, lookup, describe, reachability=None):
+        self.lookup = lookup
+        self.describe = describe
+        self.reachability = reachability
+
+    def find(self, request, key):
+        name = request.get(key)
+        if not isinstance(name, str):
+            raise QueryError('missing "%s"' % key)
+        fcns = self.lookup(name)
+        if not fcns:
+            raise QueryError('function %s not found' % name)
+        return fcns
+
+    def walk(self, fcns, attr, depth=None):
+        # Breadth first walk along attr. Returns [(fcn, distance)] for every
+        # function reached, excluding the starting functions.
+        seen = set(id(f) for f in fcns)
+        reached = []
+        queue = deque((f, 0) for f in fcns)
+        while queue:
+            (fcn, d) = queue.popleft()
+            if depth is not None and d == depth:
+                continue
+            for nxt in getattr(fcn, attr):
+                if id(nxt) not in seen:
+                    seen.add(id(nxt))
+                    reached.append((nxt, d + 1))
+                    queue.append((nxt, d + 1))
+        return reached
+
+    def neighbours(self, request, attr):
+        depth = request.get('depth', 1)
+        if depth is not None and (not isinstance(depth, int) or depth < 1):
+            raise QueryError('"depth" must be a positive integer or null')
+        fcns = self.find(request, 'name')
+        result = []
+        for (fcn, d) in self.walk(fcns, attr, depth):
+            desc = self.describe(fcn)
+            desc['depth'] = d
+            result.append(desc)
+        return {'functions': result}
+
+    def paths_between(self, request):
+        limit = request.get('limit', 1)
+        max_length = request.get('max-length')
+        if not isinstance(limit, int) or limit < 1:
+            raise QueryError('"limit" must be a positive integer')
+        if max_length is not None and (not isinstance(max_length, int) or max_length < 0):
+            raise QueryError('"max-length" must be a non-negative integer or null')
+        sources = self.find(request, 'source')
+        targets = self.find(request, 'target')
+        paths = find_paths(sources, targets, limit, max_length)
+        return {'paths': [[self.describe(f) for f in path] for path in paths]}
+
+    def reachable(self, request):
+        if 'source' not in request:
+            targets = self.find(request, 'target')
+            if self.reachability is None:
+                fcns = [f for (f, d) in self.walk(targets, 'callers')]
+            else:
+                ids = set(id(f) for f in targets)
+                fcns = [f for f in self.reachability.reachable_to(targets) if id(f) not in ids]
+            return {'functions': [self.describe(f) for f in fcns]}
+
+        sources = self.find(request, 'source')
+        if 'target' in request:
+            targets = self.find(request, 'target')
+            if self.reachability is None:
+                reachable = shortest_path(sources, targets) is not None
+            else:
+                reachable = self.reachability.reaches(sources, targets)
+            return {'reachable': reachable}
+        if self.reachability is None:
+            fcns = [f for (f, d) in self.walk(sources, 'callees')]
+        else:
+            ids = set(id(f) for f in sources)
+            fcns = [f for f in self.reachability.reachable_from(sources) if id(f) not in ids]
+        return {'functions': [self.describe(f) for f in fcns]}
+
+    def answer(self, request):
+        if not isinstance(request, dict):
+            raise QueryError('request must be a JSON object')
+        query = request.get('query')
+        if query == 'callers-of':
+            return self.neighbours(request, 'callers')
+        if query == 'callees-of':
+            return self.neighbours(request, 'callees')
+        if query == 'paths-between':
+            return self.paths_between(request)
+        if query == 'reachability':
+            return self.reachable(request)
+        if query == 'shutdown':
+            return {}
+        raise QueryError('unknown query %r, expected one of %s' % (query, ', '.join(QUERIES)))
+
+    def answer_line(self, line):
+        # Returns (response line, whether to shut down).
+        response = {}
+        shutdown = False
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            request = None
+            response['error'] = 'invalid JSON: %s' % e
+        else:
+            if isinstance(request, dict) and 'id' in request:
+                response['id'] = request['id']
+            try:
+                response.update(self.answer(request))
+                shutdown = request.get('query') == 'shutdown'
+            except QueryError as e:
+                response['error'] = str(e)
+        return (json.dumps(response) + '\n', shutdown)
+
+
+def serve_stream(engine, infile, outfile):
+    # Serves requests from infile until it is closed or a shutdown query
+    # arrives. Returns True on shutdown.
+    for line in infile:
+        if not line.strip():
+            continue
+        (response, shutdown) = engine.answer_line(line)
+        outfile.write(response)
+        outfile.flush()
+        if shutdown:
+            return True
+    return False
+
+
+class QueryRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        reader = (line.decode('utf-8', 'replace') for line in self.rfile)
+        writer = SocketWriter(self.wfile)
+        if serve_stream(self.server.engine, reader, writer):
+            # shutdown() waits for serve_forever() to return, so it can not
+            # be called from the serving thread.
+            threading.Thread(target=self.server.shutdown).start()
+
+
+class SocketWriter:
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf-8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, engine):
+        self.engine = engine
+        super().__init__(path, QueryRequestHandler)
+
+
+def serve_socket(engine, path):
+    # Serves clients on a Unix socket at path until a shutdown query.
+    if os.path.exists(path):
+        os.unlink(path)
+    server = QueryServer(path, engine)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def serve(engine, socket_path=None):
+    if socket_path:
+        serve_socket(engine, socket_path)
+    else:
+        serve_stream(engine, sys.stdin, sys.stdout)
@@ -0,0 +1,261 @@
+import struct
+from array import array
+from collections import deque
+from graph_cache import align, pad
+
+# Reachability over a utility.CallGraph, following caller to callee edges.
+#
+# The graph is condensed into its strongly connected components. Tarjan's
+# algorithm numbers components in reverse topological order, so every edge
+# of the condensation goes from a higher to a lower component id, and a
+# component can only reach components with smaller ids. For graphs of up
+# to CLOSURE_LIMIT components the transitive closure is also kept, as one
+# bitmap row per component, which turns reachability into a bit test.
+
+CLOSURE_LIMIT = 16384
+
+MAGIC = b'ENCR'
+FORMAT_VERSION = 1
+# magic, format version, node count, component count, condensation edge
+# count, bytes per closure row (0 without a closure)
+HEADER = struct.Struct('<4sIIIII')
+SUFFIX = '.reach'
+
+
+def strongly_connected_components(successors):
+    # Iterative Tarjan. Returns (component of each node, component count).
+    n = len(successors)
+    index = [-1] * n
+    low = [0] * n
+    on_stack = bytearray(n)
+    component = array('I', [0]) * n
+    stack = []
+    counter = 0
+    count = 0
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, iter(successors[root]))]
+        while work:
+            (v, it) = work[-1]
+            descended = False
+            for w in it:
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = 1
+                    work.append((w, iter(successors[w])))
+                    descended = True
+                    break
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            if descended:
+                continue
+            work.pop()
+            if work and low[v] < low[work[-1][0]]:
+                low[work[-1][0]] = low[v]
+            if low[v] == index[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = 0
+                    component[w] = count
+                    if w == v:
+                        break
+                count += 1
+    return (component, count)
+
+
+class ReachabilityIndex:
+    def __init__(self, graph=None, closure=None):
+        # closure: True, False, or None to keep the closure only for graphs
+        # of up to CLOSURE_LIMIT components.
+        self.component = array('I')
+        self.count = 0
+        self.dag_offsets = array('I', [0])
+        self.dag_targets = array('I')
+        self.row_bytes = 0
+        self.closure = None
+        self.members = None
+        self.reverse = None
+        if graph is not None:
+            self.build(graph.callee_ids, closure)
+
+    def build(self, successors, closure=None):
+        (self.component, self.count) = strongly_connected_components(successors)
+
+        dag = [set() for c in range(self.count)]
+        for (v, targets) in enumerate(successors):
+            cv = self.component[v]
+            for w in targets:
+                if self.component[w] != cv:
+                    dag[cv].add(self.component[w])
+        self.dag_offsets = array('I', [0])
+        self.dag_targets = array('I')
+        for targets in dag:
+            self.dag_targets.extend(sorted(targets))
+            self.dag_offsets.append(len(self.dag_targets))
+
+        if closure is None:
+            closure = self.count <= CLOSURE_LIMIT
+        if closure:
+            self.build_closure()
+
+    def build_closure(self):
+        # Successors have smaller ids, so their rows are complete by the
+        # time a component is reached.
+        self.row_bytes = (self.count + 7) // 8
+        self.closure = bytearray(self.count * self.row_bytes)
+        rows = []
+        for c in range(self.count):
+            bits = 1 << c
+            for d in self.successors(c):
+                bits |= rows[d]
+            rows.append(bits)
+            self.closure[c * self.row_bytes:(c + 1) * self.row_bytes] = \
+                bits.to_bytes(self.row_bytes, 'little')
+
+    def successors(self, c):
+        return self.dag_targets[self.dag_offsets[c]:self.dag_offsets[c + 1]]
+
+    def predecessors(self, c):
+        if self.reverse is None:
+            self.reverse = [[] for i in range(self.count)]
+            for src in range(self.count):
+                for dst in self.successors(src):
+                    self.reverse[dst].append(src)
+        return self.reverse[c]
+
+    def component_members(self, c):
+        if self.members is None:
+            self.members = [[] for i in range(self.count)]
+            for (v, cv) in enumerate(self.component):
+                self.members[cv].append(v)
+        return self.members[c]
+
+    def row(self, c):
+        return int.from_bytes(self.closure[c * self.row_bytes:(c + 1) * self.row_bytes], 'little')
+
+    def walk(self, components, step, limit=None):
+        # Components reachable through step(), skipping those below limit.
+        seen = set(components)
+        queue = deque(seen)
+        while queue:
+            c = queue.popleft()
+            for d in step(c):
+                if d not in seen and (limit is None or d >= limit):
+                    seen.add(d)
+                    queue.append(d)
+        return seen
+
+    def reaches(self, sources, targets):
+        # Whether any of the source nodes reaches any of the target nodes.
+        targets = set(self.component[v] for v in targets)
+        if not targets:
+            return False
+        sources = set(self.component[v] for v in sources)
+        if self.closure is not None:
+            bits = 0
+            for c in sources:
+                bits |= self.row(c)
+            return any(bits >> c & 1 for c in targets)
+        return not targets.isdisjoint(self.walk(sources, self.successors, min(targets)))
+
+    def reachable_from(self, sources):
+        # Nodes reachable from any of sources, including sources.
+        components = set(self.component[v] for v in sources)
+        if self.closure is not None:
+            bits = 0
+            for c in components:
+                bits |= self.row(c)
+            return set(v for (v, c) in enumerate(self.component) if bits >> c & 1)
+        return self.expand(self.walk(components, self.successors))
+
+    def reachable_to(self, targets):
+        # Nodes that reach any of targets, including targets.
+        components = set(self.component[v] for v in targets)
+        return self.expand(self.walk(components, self.predecessors))
+
+    def expand(self, components):
+        nodes = set()
+        for c in components:
+            nodes.update(self.component_members(c))
+        return nodes
+
+    def dump(self):
+        data = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.component),
+                                     self.count, len(self.dag_targets), self.row_bytes))
+        for section in [self.component, self.dag_offsets, self.dag_targets]:
+            pad(data)
+            data.extend(section.tobytes())
+        if self.closure is not None:
+            pad(data)
+            data.extend(self.closure)
+        return bytes(data)
+
+
+def load_reachability_index(buf, nodes):
+    # Returns None if buf is not an index of a graph with the given number
+    # of nodes.
+    (magic, version, count, components, edges, row_bytes) = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != FORMAT_VERSION or count != nodes:
+        return None
+    index = ReachabilityIndex()
+    index.count = components
+    pos = HEADER.size
+    for (attr, length) in [('component', nodes), ('dag_offsets', components + 1),
+                           ('dag_targets', edges)]:
+        pos = align(pos)
+        section = array('I')
+        section.frombytes(buf[pos:pos + length * section.itemsize])
+        setattr(index, attr, section)
+        pos += length * section.itemsize
+    if row_bytes:
+        pos = align(pos)
+        index.row_bytes = row_bytes
+        index.closure = bytearray(buf[pos:pos + components * row_bytes])
+    return index
+
+
+def load_cached_index(graph_cache, key, nodes):
+    # The index is stored next to the graph, under the same key.
+    path = graph_cache.cache.get(key, SUFFIX)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return load_reachability_index(f.read(), nodes)
+    except (OSError, struct.error):
+        return None
+
+
+def store_cached_index(graph_cache, key, index):
+    return graph_cache.cache.put(key, SUFFIX, index.dump())
+
+
+class GraphReachability:
+    # Answers reachability between functions of graph with index. key(fcn)
+    # is the key the function was added to graph with.
+    def __init__(self, graph, index, key):
+        self.graph = graph
+        self.index = index
+        self.key = key
+
+    def ids(self, fcns):
+        return [self.graph.node_id(self.key(f)) for f in fcns]
+
+    def functions(self, ids):
+        return [self.graph.nodes[i] for i in sorted(ids)]
+
+    def reaches(self, sources, targets):
+        return self.index.reaches(self.ids(sources), self.ids(targets))
+
+    def reachable_from(self, fcns):
+        return self.functions(self.index.reachable_from(self.ids(fcns)))
+
+    def reachable_to(self, fcns):
+        return self.functions(self.index.reachable_to(self.ids(fcns)))
@@ -0,0 +1,68 @@
+import bisect
+import re
+from elf_file import SHF_EXECINSTR, SHT_NOBITS
+
+# Candidate references between functions, found by scanning code for the
+# bytes of the instructions that x86_decoder reports as edges instead of
+# decoding it:
+#
+#   e8/e9 rel32             call and jmp
+#   8d modrm(rip) disp32    lea of a RIP-relative address
+#
+# The same bytes can occur inside other instructions, so the references
+# found are a superset of the real ones, to be confirmed by decoding the
+# functions they lead to. A scan is far cheaper than decoding every
+# function, which makes it a good way to find the few functions that can be
+# the callers of a function.
+
+REFERENCE_RE = re.compile(b'[\xe8\xe9]|\x8d[\x05\x0d\x15\x1d\x25\x2d\x35\x3d]', re.DOTALL)
+
+
+class ReferenceIndex:
+    # extents maps the address of each function to (section, size), as in
+    # NativeElfParser.
+    def __init__(self, elf, extents):
+        self.starts = sorted(extents)
+        self.ends = [start + extents[start][1] for start in self.starts]
+        # Addresses of the functions that may refer to each function.
+        self.callers = {}
+        starts = set(self.starts)
+        for section in elf.sections:
+            if section.flags & SHF_EXECINSTR and section.type != SHT_NOBITS:
+                self.scan(elf.section_data(section), section.address, starts)
+
+    def scan(self, code, address, starts):
+        for match in REFERENCE_RE.finditer(code):
+            pos = match.start()
+            # The displacement ends the instruction: an lea has no
+            # immediate after it.
+            field = pos + len(match.group())
+            end = field + 4
+            if end > len(code):
+                break
+            target = address + end + int.from_bytes(code[field:end], 'little', signed=True)
+            if target not in starts:
+                continue
+            idx = bisect.bisect_right(self.starts, address + pos) - 1
+            if idx < 0 or address + pos >= self.ends[idx]:
+                continue
+            callers = self.callers.get(target)
+            if callers is None:
+                self.callers[target] = [self.starts[idx]]
+            elif callers[-1] != self.starts[idx]:
+                callers.append(self.starts[idx])
+
+    def callers_within(self, addresses, depth):
+        # The functions from which addresses may be reached within depth
+        # references, including addresses.
+        found = set(addresses)
+        frontier = list(found)
+        for d in range(depth):
+            following = []
+            for address in frontier:
+                for caller in self.callers.get(address, []):
+                    if caller not in found:
+                        found.add(caller)
+                        following.append(caller)
+            frontier = following
+        return found
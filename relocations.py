@@ -0,0 +1,152 @@
+import bisect
+from array import array
+from elf_file import ElfFile, SHF_EXECINSTR, STT_FUNC, STT_OBJECT, STT_SECTION
+from utility import RELOCATIONS, Function, link_call_edges
+
+SHT_RELA = 4
+
+R_X86_64_64 = 1
+R_X86_64_PC32 = 2
+R_X86_64_PLT32 = 4
+R_X86_64_RELATIVE = 8
+
+# Sections whose raw contents are scanned for function pointers. This finds
+# tables in binaries that are not position independent and so carry no
+# dynamic relocations for them. Only sections that hold pointers are
+# scanned: in .data, any word that happens to equal a function address
+# would become an edge, so pointers there are found from relocations only.
+POINTER_TABLE_SECTIONS = ['.data.rel.ro', '.init_array', '.fini_array',
+                          '.preinit_array']
+
+
+def signed64(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class RelocationEdges:
+    # Finds call edges without disassembling .text:
+    #
+    #  - Function pointers stored in data, from R_X86_64_RELATIVE and
+    #    R_X86_64_64 relocations and from the raw contents of pointer table
+    #    sections. The data object holding the pointer becomes a node that
+    #    calls the function, so that e.g. an ecall table shows up as the
+    #    caller of every ecall. Code that takes the table's address then
+    #    links to the table when disassembly edges are also used.
+    #  - Relocations against code kept with --emit-relocs, which give
+    #    direct call edges.
+    def __init__(self, binary_file_name, elf=None):
+        self.elf = elf or ElfFile(binary_file_name)
+        self.symbols = self.elf.symbols('.symtab') or self.elf.symbols('.dynsym')
+        objects = [sym for sym in self.symbols
+                   if sym.type == STT_OBJECT and sym.name]
+        objects.sort(key=lambda sym: sym.value)
+        self.objects = objects
+        self.object_addresses = [sym.value for sym in objects]
+
+    def read_rela(self, section):
+        # Flat (offset, info, addend) triples.
+        entries = array('Q')
+        entries.frombytes(self.elf.section_data(section))
+        return entries
+
+    def pointer_slots(self):
+        # Yields (slot address, pointer value) pairs.
+        for section in self.elf.sections:
+            if section.type != SHT_RELA:
+                continue
+            if section.info and self.elf.sections[section.info].flags & SHF_EXECINSTR:
+                continue
+            symbols = None
+            entries = self.read_rela(section)
+            for idx in range(0, len(entries), 3):
+                rtype = entries[idx + 1] & 0xffffffff
+                if rtype == R_X86_64_RELATIVE:
+                    yield (entries[idx], signed64(entries[idx + 2]))
+                elif rtype == R_X86_64_64:
+                    if symbols is None:
+                        symbols = self.elf.symbol_table(self.elf.sections[section.link])
+                    sym = symbols[entries[idx + 1] >> 32]
+                    yield (entries[idx], sym.value + signed64(entries[idx + 2]))
+
+        for name in POINTER_TABLE_SECTIONS:
+            section = self.elf.section(name)
+            if section is None or section.size < 8:
+                continue
+            words = array('Q')
+            words.frombytes(self.elf.section_data(section)[:section.size & ~7])
+            for (idx, value) in enumerate(words):
+                if value:
+                    yield (section.address + idx * 8, value)
+
+    def slot_owner(self, functions_table, slot):
+        # The data object containing slot, added to the table as a node.
+        idx = bisect.bisect_right(self.object_addresses, slot) - 1
+        owner = None
+        if idx >= 0 and self.objects[idx].value + max(self.objects[idx].size, 8) > slot:
+            owner = self.objects[idx]
+        if owner is not None:
+            (name, address) = (owner.name, owner.value)
+        else:
+            section = self.section_containing(slot)
+            if section is None:
+                return None
+            (name, address) = (section.name, section.address)
+
+        try:
+            return functions_table.lookup(address)
+        except KeyError:
+            f = Function(name=name,
+                         location=[],
+                         address=address,
+                         code=None,
+                         callees=[],
+                         callers=[])
+            functions_table.add(f)
+            return f
+
+    def section_containing(self, address):
+        for section in self.elf.sections:
+            if section.address and section.address <= address < section.address + section.size:
+                return section
+        return None
+
+    def code_edges(self, functions_table):
+        # Yields (caller, callee) address pairs from relocations against
+        # executable sections.
+        for section in self.elf.sections:
+            if section.type != SHT_RELA or not section.info:
+                continue
+            if not self.elf.sections[section.info].flags & SHF_EXECINSTR:
+                continue
+            symbols = self.elf.symbol_table(self.elf.sections[section.link])
+            entries = self.read_rela(section)
+            for idx in range(0, len(entries), 3):
+                rtype = entries[idx + 1] & 0xffffffff
+                if rtype not in (R_X86_64_PC32, R_X86_64_PLT32):
+                    continue
+                sym = symbols[entries[idx + 1] >> 32]
+                if sym.type == STT_FUNC:
+                    target = sym.value
+                elif sym.type == STT_SECTION:
+                    target = self.elf.sections[sym.section_index].address + signed64(entries[idx + 2]) + 4
+                else:
+                    continue
+                caller = functions_table.lookup_containing(entries[idx])
+                if caller is not None:
+                    yield (caller.address, target)
+
+    def add_edges(self, functions_table):
+        # Links the edges into functions_table, as found by RELOCATIONS.
+        call_edges = array('Q')
+        for (caller, callee) in self.code_edges(functions_table):
+            call_edges.append(caller)
+            call_edges.append(callee)
+
+        for (slot, value) in self.pointer_slots():
+            if value not in functions_table.table:
+                continue
+            owner = self.slot_owner(functions_table, slot)
+            if owner is not None and owner.address != value:
+                call_edges.append(owner.address)
+                call_edges.append(value)
+        link_call_edges(functions_table, call_edges, RELOCATIONS)
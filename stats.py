@@ -0,0 +1,155 @@
+import contextlib
+import cProfile
+import json
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+# Phase timers and counters of one run, reported as JSON with --stats.
+#
+# Phases:
+#   tool          running objdump or llvm-objdump; in trace.py, which
+#                 parses archive listings as they are read, this includes
+#                 cutting them into members
+#   split         cutting listings into functions
+#   regex         parsing listings, symbol tables and the cross reference
+#                 table
+#   decode        reading symbols and decoding code, native backend
+#   scan          finding the functions to decode by their call bytes,
+#                 callgraph.py --lazy
+#   nm, demangle  running nm -l and c++filt
+#   relocations   finding edges through relocations
+#   analyze       linking functions into the call graph
+#   hash          hashing normalized function code
+#   cache-load, cache-store
+#   reachability  building the reachability index
+#   load          waiting for the worker processes of trace.py
+#   walk, paths, export, diff
+#
+# A phase's time excludes the phases nested in it. Phases of worker
+# processes are added up across the workers, and phases of other threads
+# overlap the phase that waits for them.
+#
+# Counters include functions, edges, unresolved-callees (call targets that
+# are not the start of a known function), unmatched-map-functions (linker
+# map functions not found in the binary with callgraph.py --map) and the
+# hits and misses of each cache.
+
+MEMORY_TOP = 10
+
+
+class Stats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        # Per thread, the time spent in the phases nested in each running
+        # phase.
+        self.threads = threading.local()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        nested = getattr(self.threads, 'nested', None)
+        if nested is None:
+            nested = self.threads.nested = []
+        nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            exclusive = elapsed - nested.pop()
+            if nested:
+                nested[-1] += elapsed
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + exclusive
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, value):
+        self.counters[name] = value
+
+    def merge(self, phases, counters):
+        with self.lock:
+            for (name, seconds) in phases.items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+        for (name, n) in counters.items():
+            self.count(name, n)
+
+    def report(self):
+        report = {'elapsed': time.perf_counter() - self.start,
+                  'phases': dict(sorted(self.phases.items())),
+                  'counters': dict(sorted(self.counters.items())),
+                  'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'tool_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+        if tracemalloc.is_tracing():
+            (current, peak) = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:MEMORY_TOP]
+            report['memory'] = {'current': current, 'peak': peak,
+                                'top': [{'location': '%s:%d' % (s.traceback[0].filename,
+                                                                s.traceback[0].lineno),
+                                         'size': s.size, 'count': s.count} for s in top]}
+        return report
+
+
+STATS = Stats()
+
+
+def phase(name):
+    return STATS.phase(name)
+
+
+def count(name, n=1):
+    STATS.count(name, n)
+
+
+def record(name, value):
+    STATS.record(name, value)
+
+
+def run_counted(fn, *args):
+    # Runs fn in a worker process, and returns its result with the phases
+    # and counters of the call, for merge_counted().
+    global STATS
+    STATS = Stats()
+    result = fn(*args)
+    return (result, STATS.phases, STATS.counters)
+
+
+def merge_counted(counted):
+    (result, phases, counters) = counted
+    STATS.merge(phases, counters)
+    return result
+
+
+def start_capture(profile=None, memory=False):
+    # Starts cProfile when profile names an output file, and tracemalloc
+    # when memory is set. Returns the profiler for finish_capture().
+    if memory:
+        tracemalloc.start()
+    profiler = None
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def finish_capture(profiler, profile=None, report=None):
+    # Writes the profile, and the stats report to the file report (- for
+    # stderr).
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile)
+    if report is None:
+        return
+    text = json.dumps(STATS.report(), indent=2) + '\n'
+    if report == '-':
+        sys.stderr.write(text)
+    else:
+        with open(report, 'w') as f:
+            f.write(text)
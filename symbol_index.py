@@ -0,0 +1,108 @@
+import bisect
+
+# Name lookups for symbol tables too large to scan for every query:
+#
+#  - exact lookups of names and of alternative keys (mangled or demangled
+#    spellings) through dicts
+#  - substring search through an index of the 3-grams of every name
+#  - prefix search on every scope of a qualified C++ name, so that
+#    'Foo::bar' finds 'ns::Foo::bar(int)'
+#
+# The n-gram and prefix indexes are built on their first use.
+
+GRAM = 3
+
+
+def scope_starts(name):
+    # Offsets of the scopes of a qualified name: after each '::' that is not
+    # inside template arguments or a parameter list.
+    starts = [0]
+    nesting = 0
+    for (pos, c) in enumerate(name):
+        if c in '<(':
+            nesting += 1
+        elif c in '>)' and nesting > 0:
+            nesting -= 1
+        elif c == ':' and nesting == 0 and name.startswith('::', pos) and pos + 2 < len(name):
+            starts.append(pos + 2)
+    return starts
+
+
+class SymbolIndex:
+    def __init__(self, names=(), aliases=None):
+        # aliases maps alternative keys to names.
+        self.names = []
+        self.ids = {}
+        self.aliases = {}
+        self.grams = None
+        self.scopes = None
+        for name in names:
+            self.add(name)
+        for (alias, name) in (aliases or {}).items():
+            self.add_alias(alias, name)
+
+    def add(self, name):
+        if name in self.ids:
+            return
+        self.ids[name] = len(self.names)
+        self.names.append(name)
+        self.grams = None
+        self.scopes = None
+
+    def add_alias(self, alias, name):
+        if alias != name and alias not in self.ids:
+            self.aliases[alias] = name
+
+    def canonical(self, key):
+        # The name stored for key, or None.
+        if key in self.ids:
+            return key
+        return self.aliases.get(key)
+
+    def build_grams(self):
+        self.grams = {}
+        for (i, name) in enumerate(self.names):
+            for gram in set(name[pos:pos + GRAM] for pos in range(len(name) - GRAM + 1)):
+                postings = self.grams.get(gram)
+                if postings is None:
+                    self.grams[gram] = [i]
+                else:
+                    postings.append(i)
+
+    def search(self, fragment):
+        # Names containing fragment, in the order they were added.
+        if len(fragment) < GRAM:
+            return [name for name in self.names if fragment in name]
+        if self.grams is None:
+            self.build_grams()
+        postings = []
+        for pos in range(len(fragment) - GRAM + 1):
+            ids = self.grams.get(fragment[pos:pos + GRAM])
+            if ids is None:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates.intersection_update(ids)
+            if not candidates:
+                return []
+        return [self.names[i] for i in sorted(candidates) if fragment in self.names[i]]
+
+    def build_scopes(self):
+        self.scopes = []
+        for (i, name) in enumerate(self.names):
+            for start in scope_starts(name):
+                self.scopes.append((name[start:], i))
+        self.scopes.sort()
+
+    def prefix(self, prefix):
+        # Names of which the whole name or an inner scope starts with prefix.
+        if self.scopes is None:
+            self.build_scopes()
+        ids = set()
+        pos = bisect.bisect_left(self.scopes, (prefix, -1))
+        while pos < len(self.scopes) and self.scopes[pos][0].startswith(prefix):
+            ids.add(self.scopes[pos][1])
+            pos += 1
+        return [self.names[i] for i in sorted(ids)]
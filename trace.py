@@ -3,138 +3,407 @@
 # Licensed under the MIT License.
 
 from collections import namedtuple
-from queue import Queue
+from concurrent.futures import ProcessPoolExecutor
 
 import argparse
+import contextlib
+import os
+import pickle
 import re
 import subprocess
 import sys
-import threading
+import tempfile
 
+import stats
 
-Object = namedtuple('Object', 'filename listing functions')
-Function = namedtuple('Function', 'name qualifiedname object listing callee_names callees callers')
+from ar_archive import read_archive_members
+from cache import CacheDirectory, DEFAULT_CACHE_DIR, bytes_digest, file_digest, make_key, tool_version
+from query_server import QueryEngine, serve
+from graph_export import FORMATS, GraphExport, caller_subgraph
+from paths import print_call_paths
+from symbol_index import SymbolIndex
+from utility import LINKER_MAP, CallGraph, demangle
+from walker import LineWriter, print_callstacks
+
+# Only names and calls are kept of the disassembly, so that memory use is
+# bounded by the size of the graph rather than of the listings.
+Object = namedtuple('Object', 'filename functions functions_by_name callers_by_callee')
+Function = namedtuple('Function', 'name qualifiedname object callee_names callees callers')
 
 colorize = True
 
+OBJECT_CACHE_VERSION = '1'
+
+
+class ObjectCache:
+    # Parsed function records of objects and archive members, keyed by the
+    # content hash of the object.
+    def __init__(self, directory=None):
+        self.cache = CacheDirectory(os.path.join(directory or DEFAULT_CACHE_DIR, 'objects'))
+        self.tool_version = tool_version('objdump')
+
+    def key(self, digest):
+        return make_key('object', OBJECT_CACHE_VERSION, digest, self.tool_version)
+
+    def get(self, digest):
+        path = self.cache.get(self.key(digest), '.pickle')
+        records = None
+        if path is not None:
+            try:
+                with open(path, 'rb') as f, stats.phase('cache-load'):
+                    records = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+        stats.count('object-cache-misses' if records is None else 'object-cache-hits')
+        return records
+
+    def put(self, digest, records):
+        with stats.phase('cache-store'):
+            self.cache.put(self.key(digest), '.pickle', pickle.dumps(records), evict=False)
+
+    def evict(self):
+        self.cache.evict()
+
+
+def parse_object_listing(listing):
+    with stats.phase('regex'):
+        splits = re.split('\n[0-9a-fA-F]{16,} <(\S+)>:', listing)
 
-def process_object_listing(object):
-    splits = re.split('\n[0-9a-fA-F]{16,} <(\S+)>:', object.listing)
-
-    #    print(object.listing)
-    # Note: Any ref is treated as a call.
-    # It is worth exploring if we need to consider only callq, jmpq,
-    # lea instructions.
-    call_re = re.compile('R_X86_64_PLT32\s+(?:\.text\.)?(\w+)-')
-    for i in range(1, len(splits), 2):
-        name = splits[i]
-        listing = splits[i+1]
-        callee_names = call_re.findall(listing)
-        fcn = Function(name=name,
-                       qualifiedname='%s:%s'%(object.filename, name),
-                       object=object,
-                       listing=listing,
-                       callee_names=callee_names,
-                       callees=[],
-                       callers=[])
-        object.functions.append(fcn)
-
-def process_load(filename, queue):
-    print('Processing %s' % filename)
-    listing = subprocess.check_output(['objdump', '-d', '-r', filename], encoding='utf-8')
-    if filename.endswith('.o'):
-        object = Object(filename=filename, listing=listing, functions=[])        
-        process_object_listing(object)
-        queue.put(object)
-    elif filename.endswith('.a'):
-        # Note: The \n at the start of the regex is needed for  fast matching.
-        splits = re.split('\n(\S+)\.o:\s+file format \S+', listing)
+        # Note: Any ref is treated as a call.
+        # It is worth exploring if we need to consider only callq, jmpq,
+        # lea instructions.
+        call_re = re.compile('R_X86_64_PLT32\s+(?:\.text\.)?(\w+)-')
+        records = []
         for i in range(1, len(splits), 2):
-            object = Object(filename='%s(%s.o)' % (filename, splits[i]),
-                            listing=splits[i+1],
-                            functions=[])
-            process_object_listing(object)
-            queue.put(object)            
-
-def process_loads(text):
-    # Gather all loaded objects and libs
-    loaded = re.findall('LOAD\s+(\S+)', text)
-    threads = []
-    queue = Queue()
-    for l in loaded:
-        t = threading.Thread(target=process_load, args=(l,queue))
-        threads.append(t)
-        t.start()
-    for t in threads:
-        t.join()
+            records.append((splits[i], call_re.findall(splits[i+1])))
+    return records
+
+@contextlib.contextmanager
+def disassembly_lines(filename):
+    # The lines of objdump's listing of filename, read as objdump writes
+    # them.
+    with subprocess.Popen(['objdump', '-d', '-r', filename], stdout=subprocess.PIPE,
+                          encoding='utf-8') as process:
+        yield process.stdout
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+def split_archive_listing(filename, lines):
+    # Yields (member name, listing) pairs of an archive's listing, holding
+    # one member's listing at a time.
+    header_re = re.compile('(\S+)\.o:\s+file format \S+')
+    name = None
+    listing = []
+    for line in lines:
+        match = header_re.match(line) if 'file format' in line else None
+        if match:
+            if name is not None:
+                yield (name, ''.join(listing))
+            name = '%s(%s.o)' % (filename, match.group(1))
+            listing = [line[match.end():]]
+        elif name is not None:
+            listing.append(line)
+    if name is not None:
+        yield (name, ''.join(listing))
+
+def parse_load(filename, lines):
+    # Returns (object filename, function records) pairs of the listing of an
+    # object or archive.
+    if filename.endswith('.a'):
+        return [(name, parse_object_listing(listing))
+                for (name, listing) in split_archive_listing(filename, lines)]
+    return [(filename, parse_object_listing(''.join(lines)))]
+
+def process_object_listing(filename, records):
+    object = Object(filename=filename, functions=[], functions_by_name={},
+                    callers_by_callee={})
+    with stats.phase('analyze'):
+        for (name, callee_names) in records:
+            fcn = Function(name=name,
+                           qualifiedname='%s:%s'%(filename, name),
+                           object=object,
+                           callee_names=callee_names,
+                           callees=[],
+                           callers=[])
+            object.functions.append(fcn)
+            object.functions_by_name.setdefault(name, fcn)
+            # Inverted index of the calls, to link cref entries by name.
+            for callee in dict.fromkeys(callee_names):
+                object.callers_by_callee.setdefault(callee, []).append(fcn)
+    return object
+
+def process_load(filename):
+    # Runs in a worker process. Returns filename and its (object filename,
+    # function records) pairs, or None for them if it can not be
+    # disassembled. Only the records are sent back to the parent, not the
+    # listings. The parent prints the progress, so that it goes where the
+    # parent's stdout does.
+    if not (filename.endswith('.o') or filename.endswith('.a')):
+        return (filename, [])
+    try:
+        with stats.phase('tool'), disassembly_lines(filename) as lines:
+            return (filename, parse_load(filename, lines))
+    except subprocess.CalledProcessError:
+        return (filename, None)
+
+def process_member(archive, member):
+    # Runs in a worker process. Disassembles a single archive member, with
+    # the result of process_load().
+    name = '%s(%s)' % (archive, member.name)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, os.path.basename(member.name))
+        with open(path, 'wb') as f:
+            f.write(member.data)
+        try:
+            with stats.phase('tool'), disassembly_lines(path) as lines:
+                records = parse_object_listing(lines.read())
+        except subprocess.CalledProcessError:
+            return (name, None)
+    return (name, [(name, records)])
+
+def lookup_cached_load(filename, object_cache, object_table, digests):
+    # Adds cached objects to object_table and returns the work items needed
+    # for the rest. digests records the hash of every object to be parsed.
+    try:
+        if filename.endswith('.o'):
+            digest = file_digest(filename)
+            records = object_cache.get(digest)
+            if records is None:
+                digests[filename] = digest
+                return [(process_load, filename)]
+            object_table[filename] = process_object_listing(filename, records)
+            return []
+        elif filename.endswith('.a'):
+            members = read_archive_members(filename)
+    except OSError:
+        return [(process_load, filename)]
+    if not filename.endswith('.a') or members is None:
+        return [(process_load, filename)]
 
+    members = [m for m in members if m.name.endswith('.o')]
+    missing = []
+    for member in members:
+        name = '%s(%s)' % (filename, member.name)
+        digest = bytes_digest(member.data)
+        records = object_cache.get(digest)
+        if records is None:
+            digests[name] = digest
+            missing.append(member)
+        else:
+            object_table[name] = process_object_listing(name, records)
+
+    # A single objdump run over the archive is cheaper than one per member
+    # when nothing is cached.
+    if len(missing) == len(members):
+        return [(process_load, filename)]
+    return [(process_member, filename, m) for m in missing]
+
+def process_loads(loaded, jobs=None, object_cache=None):
     object_table = {}
-    while not queue.empty():
-        obj = queue.get()
-        object_table[obj.filename] = obj
+    digests = {}
+    work = []
+    for filename in loaded:
+        if object_cache is None:
+            work.append((process_load, filename))
+        else:
+            work.extend(lookup_cached_load(filename, object_cache, object_table, digests))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor, stats.phase('load'):
+        run_loads(executor, work, object_table, digests, object_cache)
+
+    if object_cache is not None:
+        object_cache.evict()
     return object_table
 
+def run_loads(executor, work, object_table, digests, object_cache):
+    futures = [executor.submit(stats.run_counted, *w) for w in work]
+    for future in futures:
+        (name, loads) = stats.merge_counted(future.result())
+        print('Processing %s' % name)
+        if loads is None:
+            print('Error processing %s' % name)
+            continue
+        for (filename, records) in loads:
+            object_table[filename] = process_object_listing(filename, records)
+            if filename in digests:
+                object_cache.put(digests[filename], records)
 
-def parse_cross_reference_table(text):
-    split = re.split('Symbol\s+File', text)
-    if len(split) != 2:
-        print('Cross Reference Table not found')
-        sys.exit(1)
-    entries = re.split('\n(?!\s)', split[1])
-    ignore = ['__GNU_EH_FRAME_HDR']
-    cref_table = {}
-    for entry in entries:
-        split = str.split(entry)
-        if len(split) < 2:
+def object_work(names, object_cache, object_table, digests):
+    # Work items for the objects named as in the cross reference table, e.g.
+    # 'libx.a(foo.o)' for an archive member, that are not in object_table.
+    # Only the named members of an archive are disassembled.
+    work = []
+    archives = {}
+    for name in names:
+        if name in object_table:
             continue
-        name = split[0]
-        if name in ignore:
+        if name.endswith(')') and '(' in name:
+            archives.setdefault(name[:name.rindex('(')], set()).add(name)
+        elif object_cache is None:
+            work.append((process_load, name))
+        else:
+            work.extend(lookup_cached_load(name, object_cache, object_table, digests))
+    for (archive, wanted) in archives.items():
+        try:
+            members = read_archive_members(archive)
+        except OSError:
+            members = None
+        if members is None:
+            work.append((process_load, archive))
             continue
-        cref_table[name] = split[1:]
-    return cref_table
+        members = [m for m in members if m.name.endswith('.o')]
+        missing = []
+        for member in members:
+            name = '%s(%s)' % (archive, member.name)
+            if name not in wanted:
+                continue
+            if object_cache is not None:
+                digest = bytes_digest(member.data)
+                records = object_cache.get(digest)
+                if records is not None:
+                    object_table[name] = process_object_listing(name, records)
+                    continue
+                digests[name] = digest
+            missing.append(member)
+        # As in lookup_cached_load, one objdump run over the archive is
+        # cheaper than one per member when every member is needed.
+        if len(missing) == len(members):
+            work.append((process_load, archive))
+        else:
+            work.extend((process_member, archive, m) for m in missing)
+    return work
+
+def process_caller_loads(names, depth, cref_table, jobs=None, object_cache=None):
+    # Disassembles only the objects that can hold callers of names, cref
+    # symbols, within depth calls and one call further. Each level loads the
+    # objects that the cross reference table lists for the callers found so
+    # far, and the object of each caller for its local callers.
+    object_table = {}
+    digests = {}
+    # (function name, object filename) pairs.
+    frontier = [(name, None) for name in names]
+    seen = set(frontier)
+    with ProcessPoolExecutor(max_workers=jobs) as executor, stats.phase('load'):
+        for level in range(depth + 1):
+            # The objects that may call each function of the frontier.
+            refs = []
+            for (name, objname) in frontier:
+                objnames = dict.fromkeys(cref_table.get(name, []))
+                if objname is not None:
+                    objnames[objname] = None
+                refs.append((name, objnames))
+            wanted = dict.fromkeys(objname for (name, objnames) in refs for objname in objnames)
+            run_loads(executor, object_work(wanted, object_cache, object_table, digests),
+                      object_table, digests, object_cache)
+            following = []
+            for (name, objnames) in refs:
+                for objname in objnames:
+                    obj = object_table.get(objname)
+                    if obj is None:
+                        continue
+                    for caller in obj.callers_by_callee.get(name, []):
+                        key = (caller.name, objname)
+                        if key not in seen:
+                            seen.add(key)
+                            following.append(key)
+            frontier = following
+
+    if object_cache is not None:
+        object_cache.evict()
+    return object_table
+
+
+def cross_reference_entries(lines):
+    # Yields the words of each entry of the cross reference table: a line
+    # starting with the symbol, and the indented lines after it.
+    entry = []
+    for line in lines:
+        if entry and not line[:1].isspace():
+            yield entry
+            entry = []
+        entry.extend(line.split())
+    if entry:
+        yield entry
+
+def parse_linker_map(lines):
+    # Returns the files loaded by the linker, and the cross reference table
+    # mapping each symbol to the object defining it and the objects
+    # referring to it. The map is read one line at a time.
+    load_re = re.compile('LOAD\s+(\S+)')
+    header_re = re.compile('Symbol\s+File')
+    lines = iter(lines)
+    # Libraries can be loaded more than once; disassemble each only once.
+    loaded = {}
+    with stats.phase('regex'):
+        for line in lines:
+            if header_re.match(line):
+                break
+            if 'LOAD' in line:
+                loaded.update(dict.fromkeys(load_re.findall(line)))
+        else:
+            print('Cross Reference Table not found')
+            sys.exit(1)
+        ignore = ['__GNU_EH_FRAME_HDR']
+        cref_table = {}
+        for entry in cross_reference_entries(lines):
+            if len(entry) < 2 or entry[0] in ignore:
+                continue
+            cref_table[entry[0]] = entry[1:]
+    return (list(loaded), cref_table)
 
 def find_function(object, name):
-    for fcn in object.functions:
-        if fcn.name == name:
-            return fcn
+    return object.functions_by_name.get(name)
 
-def append_unique(list, value):
-    if value not in list:
-        list.append(value)
+def link(graph, caller, callee):
+    # Functions are deduplicated by identity, not by namedtuple equality.
+    graph.link(id(caller), caller, id(callee), callee, LINKER_MAP)
                   
         
 def link_functions(object_table, cref_table):
-    unresolved = {}
+    with stats.phase('analyze'):
+        (objects, functions, graph) = link_cross_references(object_table, cref_table)
+    stats.record('objects', len(objects))
+    stats.record('functions', sum(len(obj.functions) for obj in objects.values()))
+    stats.record('edges', graph.edge_count)
+    return (objects, functions)
+
+def link_cross_references(object_table, cref_table):
+    graph = CallGraph()
 
     # Find list of objects based on cref table.
     # This limits objects to only those that have been processed by linker.
+    # Objects that were not loaded are left out.
     objects = {}
     for refs in cref_table.values():
         for objname in refs:
-            obj = object_table[objname]
-            objects[objname] = obj
+            if objname in object_table:
+                objects[objname] = object_table[objname]
 
-    # Link local calls
+    # Link local calls. Calls to names that are neither local nor in the
+    # cref table can not be resolved.
+    unresolved = 0
     for obj in objects.values():
         for fcn in obj.functions:
             for callee in fcn.callee_names:
                 callee_fcn = find_function(obj, callee)
                 if callee_fcn:
-                    append_unique(fcn.callees, callee_fcn)
-                    append_unique(callee_fcn.callers, fcn)
+                    link(graph, fcn, callee_fcn)
+                elif callee not in cref_table:
+                    unresolved += 1
+    stats.count('unresolved-callees', unresolved)
                     
     # Add functions based on cref table
     functions = {}
     for (name, refs) in cref_table.items():
-        obj = objects[refs[0]]
-        fcn = find_function(obj, name)
+        obj = objects.get(refs[0])
+        fcn = find_function(obj, name) if obj else None
         if fcn:
             functions[name] = fcn
         else:
+            stats.count('undefined-functions')
             functions[name] = Function(name=name,
-                                       qualifiedname='undefined-%s' % callee,
+                                       qualifiedname='undefined-%s' % name,
                                        object=None,
-                                       listing='',
                                        callee_names=[],
                                        callees=[],
                                        callers=[])
@@ -142,110 +411,237 @@ def link_functions(object_table, cref_table):
     # Link functions based on cref table
     for (name, refs) in cref_table.items():
         fcn = functions[name]
-        match = False
-        if name == 'oe_sgx_backtrace_symbols':
-            print(refs)
-            match = True
         for ref in refs:
-            obj = objects[ref]
-            #if fcn.object == obj:
-            #    pass
-            #else:
-            for caller in obj.functions:
-                if name in caller.callee_names:
-                    if match:
-                        print(caller.name)
-                    append_unique(caller.callees, fcn)
-                    append_unique(fcn.callers, caller)
+            if ref not in objects:
+                continue
+            for caller in objects[ref].callers_by_callee.get(name, []):
+                link(graph, caller, fcn)
         
-    return (objects, functions)
+    return (objects, functions, graph)
                 
 
-def read_linker_map(filename):
-    # Read contents of map file
+def read_linker_map(filename, jobs=None, object_cache=None):
     try:
         with open(filename, 'r') as f:
-            text = f.read()
-    except:
+            (loaded, cref_table) = parse_linker_map(f)
+    except (OSError, UnicodeDecodeError):
         print('Error reading %s' % filename)
         sys.exit(1)
 
-    object_table = process_loads(text)
-    cref_table = parse_cross_reference_table(text)
+    object_table = process_loads(loaded, jobs, object_cache)
     return link_functions(object_table, cref_table)
 
-def trace(objects, functions, fcnname, depth):
-    def color_name(name):
-        return '\x1b[0;1;38;5;136m%s\x1b[0m' % name if colorize else name
-    def color_object(object):
-        return '\x1b[0;2;38;5;117m%s\x1b[0m' % object if colorize else object
-    def color_more(more):
-        return '\x1b[0;1;48;5;52m%s\x1b[0m' % more if colorize else more
-    def color_recursive(recur):
-        return '\x1b[0;1;48;5;52m%s\x1b[0m' % recur if colorize else recur
-    
-    def walk(stack, fcn, d, last=[]):
-        object_name = fcn.object.filename if fcn.object else ''
-        desc = '%s %s' % (color_name(fcn.name), color_object(object_name))
-        prefix = ''
-        for l in last[:-1]:
-            prefix += ('\u2502   ' if not l else '    ')
-        
-        if len(stack) > 0:
-            prefix = '  ' + prefix
-            if last[-1]:
-                prefix += '\u2514'
-            else:
-                prefix += '\u251c'                
-            prefix += '\u2500\u2500'
-            
-        if len(stack) == depth and len(fcn.callers) > 0:
-            desc += ' ' + color_more('...')
-        if fcn in stack:
-            desc += ' ' + color_recursive(' possible recursive call ')
-
-        print('%s %s' % (prefix, desc))
-        if len(stack) == depth or fcn in stack:
-            return
-
-        stack.append(fcn)                           
-        if len(fcn.callers) == 0:
-            pass
-        else:
-            for idx in range(0, len(fcn.callers)):
-                caller = fcn.callers[idx]
-                walk(stack, caller, d+1, last + [idx == len(fcn.callers)-1])
-        stack.pop(-1)
+def read_linker_map_callers(filename, names, depth, jobs=None, object_cache=None):
+    # Like read_linker_map, but disassembles only the objects that can hold
+    # the callers of names within depth calls. A name that is not a cref
+    # symbol, such as a static function, could be in any object, and then
+    # all are read.
+    try:
+        with open(filename, 'r') as f:
+            (loaded, cref_table) = parse_linker_map(f)
+    except (OSError, UnicodeDecodeError):
+        print('Error reading %s' % filename)
+        sys.exit(1)
 
-    if fcnname in functions:
-        walk([], functions[fcnname], 0)
+    symbols = list(cref_table)
+    index = SymbolIndex(symbols, dict(zip(demangle(symbols), symbols)))
+    roots = [index.canonical(name) for name in names]
+    if None in roots:
+        object_table = process_loads(loaded, jobs, object_cache)
     else:
-        found = False
+        object_table = process_caller_loads(roots, depth, cref_table, jobs, object_cache)
+    return link_functions(object_table, cref_table)
+
+def object_stem(filename):
+    # 'libx.a(foo.o)', 'dir/foo.o' and 'dir/foo.c' all give 'foo'.
+    if filename.endswith(')') and '(' in filename:
+        filename = filename[filename.rindex('(') + 1:-1]
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def match_function(table, fcn, demangled):
+    # The function of table, a utility.FunctionTable of the linked binary,
+    # that fcn became, or None. Functions are matched by name; a name
+    # defined more than once, as static functions can be, is told apart by
+    # the source file of the function's location.
+    candidates = table.lookup_by_name(fcn.name) or table.lookup_by_name(demangled)
+    if len(candidates) > 1 and fcn.object is not None:
+        stem = object_stem(fcn.object.filename)
+        candidates = [f for f in candidates
+                      if table.location(f) and object_stem(table.location(f).rsplit(':', 1)[0]) == stem]
+    return candidates[0] if len(candidates) == 1 else None
+
+def add_linker_map_edges(table, objects, functions):
+    # Adds the call edges of a traced linker map to table, so that one
+    # graph holds the edges of both front ends, marked LINKER_MAP.
+    fcns = [fcn for obj in objects.values() for fcn in obj.functions]
+    fcns.extend(fcn for fcn in functions.values() if fcn.object is None)
+    names = list(dict.fromkeys(fcn.name for fcn in fcns))
+    demangled = dict(zip(names, demangle(names)))
+    with stats.phase('analyze'):
+        matches = {}
+        for fcn in fcns:
+            match = match_function(table, fcn, demangled[fcn.name])
+            if match is not None:
+                matches[id(fcn)] = match
+        for fcn in fcns:
+            caller = matches.get(id(fcn))
+            if caller is None:
+                continue
+            for callee in fcn.callees:
+                match = matches.get(id(callee))
+                if match is not None:
+                    table.link(caller, match, LINKER_MAP)
+    stats.count('unmatched-map-functions', len(fcns) - len(matches))
+
+def color_name(name):
+    return '\x1b[0;1;38;5;136m%s\x1b[0m' % name if colorize else name
+def color_object(object):
+    return '\x1b[0;2;38;5;117m%s\x1b[0m' % object if colorize else object
+def color_more(more):
+    return '\x1b[0;1;48;5;52m%s\x1b[0m' % more if colorize else more
+def color_recursive(recur):
+    return '\x1b[0;1;48;5;52m%s\x1b[0m' % recur if colorize else recur
+
+def describe(fcn):
+    object_name = fcn.object.filename if fcn.object else ''
+    return '%s %s' % (color_name(fcn.name), color_object(object_name))
+
+def mark(kind, text):
+    return color_recursive(text) if kind == 'recursive' else color_more(text)
+
+class FunctionLookup:
+    # Finds functions by the names given on the command line: cref symbols
+    # first, then functions local to an object, then demangled spellings.
+    def __init__(self, objects, functions):
+        self.functions = functions
+        self.by_name = {}
         for obj in objects.values():
-            fcn = find_function(obj, fcnname)
-            if fcn:
-                found = True
-                walk([], fcn, 0)
-                
-        if not found:
-            print('Function %s not found\n' % fcnname)
+            for fcn in obj.functions:
+                self.by_name.setdefault(fcn.name, []).append(fcn)
+        self.symbols = None
+
+    def exact(self, name):
+        if name in self.functions:
+            return [self.functions[name]]
+        return self.by_name.get(name, [])
+
+    def lookup(self, name):
+        fcns = self.exact(name)
+        if fcns:
+            return fcns
+        if self.symbols is None:
+            names = list(dict.fromkeys(list(self.functions.keys()) + list(self.by_name.keys())))
+            self.symbols = SymbolIndex(names, dict(zip(demangle(names), names)))
+        name = self.symbols.canonical(name)
+        return self.exact(name) if name is not None else []
+
+def trace(lookup, fcnname, depth, writer, back_references=False):
+    print_callstacks(lookup.lookup, fcnname, depth, describe, mark, writer, back_references)
+
+def trace_paths(lookup, source, target, count, depth, writer):
+    print_call_paths(lookup.lookup, source, target, count, depth, describe, mark, writer)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Trace symbol.')
     parser.add_argument('map-file', help='path to map file generated by linker')
-    parser.add_argument('function-name',  nargs='+',                        
+    parser.add_argument('function-name',  nargs='*',                        
                         help='function to trace')
     parser.add_argument('-nc', '--no-color', metavar='', default=False,
                         action='store_const', const=True,
                         help='disable output colorization')
     parser.add_argument('-d', '--depth', metavar='', default=8, type=int,
                         help='maximum depth of callstack to print (default=8)')
-    args = parser.parse_args()
-    
-    (objects, functions) = read_linker_map(args.__dict__['map-file'])
+    parser.add_argument('-j', '--jobs', metavar='', default=None, type=int,
+                        help='number of objects to disassemble in parallel (default=CPU count)')
+    parser.add_argument('-c', '--cache', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='cache parsed objects to speed up analysis')
+    parser.add_argument('--cache-dir', metavar='', default=None,
+                        help='directory for the analysis cache')
+    parser.add_argument('-l', '--lazy', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='disassemble only the objects and archive members that the cross '
+                             'reference table lists as callers of the named functions within '
+                             'depth calls; for tracing and --export of callers only')
+    parser.add_argument('-r', '--back-references', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='print each caller subtree once and refer back to it afterwards')
+    parser.add_argument('-p', '--path-to', metavar='', default=None,
+                        help='print call paths from each function to this function, of at most '
+                             'depth calls, instead of tracing')
+    parser.add_argument('-k', '--paths', metavar='', default=1, type=int,
+                        help='number of paths to print with --path-to, shortest first (default=1)')
+    parser.add_argument('-x', '--export', metavar='', default=None,
+                        help='write the graph to this file instead of tracing; with function '
+                             'names, only their callers up to depth (- for stdout)')
+    parser.add_argument('--format', metavar='', default=None, choices=FORMATS,
+                        help='export format: jsonl, dot, graphml or csr (default=from the '
+                             'file extension, else jsonl)')
+    parser.add_argument('--serve', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='answer JSON line queries on stdin instead of tracing')
+    parser.add_argument('--socket', metavar='', default=None,
+                        help='answer JSON line queries on a Unix socket at this path')
+    parser.add_argument('--stats', metavar='', default=None,
+                        help='write phase times and counters as JSON to this file (- for stderr)')
+    parser.add_argument('--profile', metavar='', default=None,
+                        help='write a cProfile profile of the run to this file')
+    parser.add_argument('--trace-memory', metavar='', default=False,
+                        action='store_const', const=True,
+                        help='trace allocations and add the largest to the --stats report')
+    args = parser.parse_intermixed_args()
+    serving = args.serve or args.socket is not None
+    if not serving and args.export is None and not args.__dict__['function-name']:
+        parser.error('the following arguments are required: function-name')
+    if serving and args.__dict__['function-name']:
+        parser.error('function names can not be given with --serve or --socket')
+    if args.lazy and (serving or args.path_to is not None or not args.__dict__['function-name']):
+        parser.error('--lazy only traces or exports the callers of named functions')
+
+    profiler = stats.start_capture(args.profile, args.trace_memory)
+    object_cache = ObjectCache(args.cache_dir) if args.cache else None
+    # Progress messages would mix with responses on stdout.
+    quiet = serving or args.export == '-'
+    with contextlib.redirect_stdout(sys.stderr if quiet else sys.stdout):
+        if args.lazy:
+            (objects, functions) = read_linker_map_callers(args.__dict__['map-file'],
+                                                           args.__dict__['function-name'],
+                                                           args.depth, args.jobs, object_cache)
+        else:
+            (objects, functions) = read_linker_map(args.__dict__['map-file'], args.jobs,
+                                                   object_cache)
+
+    names = args.__dict__['function-name']
+    if names and args.export is None:
+        print('\nTracing...')
+    writer = LineWriter()
+    lookup = FunctionLookup(objects, functions)
+    if args.export is not None:
+        if names:
+            nodes = caller_subgraph([fcn for name in names for fcn in lookup.lookup(name)],
+                                    args.depth)
+        else:
+            nodes = [fcn for obj in objects.values() for fcn in obj.functions]
+            nodes.extend(fcn for fcn in functions.values() if fcn.object is None)
+        def attributes(fcn):
+            return [('name', fcn.name),
+                    ('object', fcn.object.filename if fcn.object else None)]
+        with stats.phase('export'):
+            GraphExport(nodes, attributes).write(args.export, args.format)
+        names = []
+    with stats.phase('paths' if args.path_to is not None else 'walk'):
+        for fcnname in names:
+            if args.path_to is not None:
+                trace_paths(lookup, fcnname, args.path_to, args.paths, args.depth, writer)
+            else:
+                trace(lookup, fcnname, args.depth, writer, args.back_references)
+    writer.flush()
+    stats.finish_capture(profiler, args.profile, args.stats)
 
-    print('\nTracing...')
-    for fcnname in args.__dict__['function-name']:
-        trace(objects, functions, fcnname, args.depth)
+    if serving:
+        def describe_json(fcn):
+            return {'name': fcn.name,
+                    'object': fcn.object.filename if fcn.object else None}
+        serve(QueryEngine(lookup.lookup, describe_json), args.socket)
 
         
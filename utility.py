@@ -1,16 +1,105 @@
 from collections import namedtuple
+import bisect
+import shutil
 import subprocess
 import re
+import multiprocessing
+import stats
+from concurrent.futures import ProcessPoolExecutor
+from symbol_index import SymbolIndex
 
 Function = namedtuple('Function', 'name location address code callees callers')
 
+# Where a call edge was found. An edge keeps the bits of every source that
+# found it.
+DISASSEMBLY = 1
+RELOCATIONS = 2
+LINKER_MAP = 4
+EDGE_SOURCES = [(DISASSEMBLY, 'disassembly'), (RELOCATIONS, 'relocations'),
+                (LINKER_MAP, 'linker-map')]
+
+
+def source_names(sources):
+    return [name for (bit, name) in EDGE_SOURCES if sources & bit]
+
+
+class CallGraph:
+    # Nodes are numbered in the order they are added. Callees are kept as
+    # dicts from node id to the sources of the edge, and callers as sets of
+    # node ids, so that duplicate edges are rejected in O(1) without
+    # comparing the nodes themselves. Both the ELF parsers and trace.py fill
+    # a CallGraph.
+    def __init__(self):
+        self.nodes = []
+        self.node_ids = {}
+        self.callee_ids = []
+        self.caller_ids = []
+        self.edge_count = 0
+
+    def add_node(self, key, node):
+        node_id = self.node_ids.get(key)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.node_ids[key] = node_id
+            self.nodes.append(node)
+            self.callee_ids.append({})
+            self.caller_ids.append(set())
+        else:
+            self.nodes[node_id] = node
+        return node_id
+
+    def node_id(self, key):
+        return self.node_ids[key]
+
+    def add_edge(self, caller_id, callee_id, sources=DISASSEMBLY):
+        # Returns whether the edge is new; the sources of a known edge are
+        # added to it.
+        callees = self.callee_ids[caller_id]
+        known = callees.get(callee_id)
+        if known is not None:
+            callees[callee_id] = known | sources
+            return False
+        callees[callee_id] = sources
+        self.caller_ids[callee_id].add(caller_id)
+        self.edge_count += 1
+        return True
+
+    def edge_sources(self, caller_id, callee_id):
+        return self.callee_ids[caller_id].get(callee_id, 0)
+
+    def link(self, caller_key, caller, callee_key, callee, sources=DISASSEMBLY):
+        # Mirror new edges into the nodes' own callees/callers lists, which
+        # keep the order in which edges were discovered.
+        caller_id = self.add_node(caller_key, caller)
+        callee_id = self.add_node(callee_key, callee)
+        if not self.add_edge(caller_id, callee_id, sources):
+            return False
+        caller.callees.append(callee)
+        callee.callers.append(caller)
+        return True
+
+
 class FunctionTable:
     def __init__(self):
         self.table = {}
         self.table_by_name = {}
+        self.sorted_addresses = None
+        self.graph = CallGraph()
+        # Source location lookup for functions whose location was not
+        # filled in while parsing, e.g. a dwarf_lines.LineTable.
+        self.locator = None
+        self.locations = {}
+        # Other spellings of function names, e.g. mangled ones.
+        self.aliases = {}
+        self.symbols = None
+        # Hashes of normalized function code by address, see graph_diff.py.
+        self.code_hashes = {}
         
     def add(self, f):
         self.table[f.address] = f
+        self.graph.add_node(f.address, f)
+        self.sorted_addresses = None
+        self.symbols = None
         if f.name in self.table_by_name:
             self.table_by_name[f.name].append(f)
         else:
@@ -22,22 +111,172 @@ class FunctionTable:
     def lookup(self, address):
         return self.table[address]
 
+    def link(self, caller, callee, sources=DISASSEMBLY):
+        return self.graph.link(caller.address, caller, callee.address, callee, sources)
+
+    def edge_sources(self, caller, callee):
+        graph = self.graph
+        return graph.edge_sources(graph.node_id(caller.address), graph.node_id(callee.address))
+
+    def location(self, fcn):
+        if fcn.location or self.locator is None:
+            return fcn.location
+        if fcn.address not in self.locations:
+            self.locations[fcn.address] = self.locator.lookup(fcn.address)
+        return self.locations[fcn.address]
+
+    def fill_locations(self, locations):
+        # Sets the locations of functions added without one from a dict by
+        # address, e.g. an nm -l table read while the functions were parsed.
+        # Functions are replaced, so this must run before they are linked.
+        for (address, f) in list(self.table.items()):
+            loc = locations.get(address)
+            if f.location or not loc:
+                continue
+            located = f._replace(location=loc)
+            self.table[address] = located
+            self.graph.add_node(address, located)
+            fcns = self.table_by_name[f.name]
+            for (i, g) in enumerate(fcns):
+                if g is f:
+                    fcns[i] = located
+
+    def add_alias(self, alias, name):
+        self.aliases[alias] = name
+        self.symbols = None
+
+    def symbol_index(self):
+        # Built on the first lookup that misses, with the demangled names as
+        # extra keys.
+        if self.symbols is None:
+            names = list(self.table_by_name.keys())
+            aliases = dict(self.aliases)
+            for (name, demangled) in zip(names, demangle(names)):
+                if demangled != name:
+                    aliases.setdefault(demangled, name)
+            self.symbols = SymbolIndex(names, aliases)
+        return self.symbols
+
     def lookup_by_name(self, name):
         try:
             return self.table_by_name[name]
         except:
-            return []
+            pass
+        name = self.symbol_index().canonical(name)
+        return self.table_by_name[name] if name is not None else []
+
+    def find_names(self, fragment):
+        # Names containing fragment. Names with a scope that starts with
+        # fragment come first.
+        symbols = self.symbol_index()
+        names = symbols.prefix(fragment)
+        found = set(names)
+        names.extend(name for name in symbols.search(fragment) if name not in found)
+        return names
 
     def get_function_names(self):
         return self.table_by_name.keys()
 
+    def lookup_containing(self, address):
+        if self.sorted_addresses is None:
+            self.sorted_addresses = sorted(self.table.keys())
+        idx = bisect.bisect_right(self.sorted_addresses, address) - 1
+        if idx < 0:
+            return None
+        return self.table[self.sorted_addresses[idx]]
+
+
+def link_call_edges(functions_table, call_edges, sources=DISASSEMBLY):
+    # call_edges is a flat sequence of (caller, callee) address pairs.
+    # Callees that are not the start of a known function, such as PLT
+    # entries or jumps within a function, are counted as unresolved.
+    unresolved = 0
+    with stats.phase('analyze'):
+        for idx in range(0, len(call_edges), 2):
+            try:
+                fcn = functions_table.lookup(call_edges[idx])
+                callee_fcn = functions_table.lookup(call_edges[idx + 1])
+            except KeyError:
+                unresolved += 1
+                continue
+            functions_table.link(fcn, callee_fcn, sources)
+    stats.count('unresolved-callees', unresolved)
+
+
+CHUNK_SIZE = 1 << 22
+# A few chunks per job even out chunks that parse slowly.
+CHUNKS_PER_JOB = 4
+
+
+def split_chunks(text, separator, count):
+    # Cuts a listing into about count chunks for parsing in parallel. Chunks
+    # end after a run of newlines that contains separator, so every
+    # function listing is within one chunk.
+    size = len(text) // count + 1
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = text.find(separator, start + size)
+        if end < 0:
+            end = len(text)
+        while end < len(text) and text[end] == '\n':
+            end += 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def stream_chunks(lines, size=CHUNK_SIZE):
+    # Groups the lines of a listing being read into chunks of about size
+    # characters that end at a blank line.
+    chunk = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size and not line.strip('\n'):
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def map_chunks(parse_chunk, chunks, jobs, *args):
+    # Runs parse_chunk(chunk, *args) on the chunks of a listing in a pool of
+    # jobs processes, and yields the results in listing order. The workers
+    # are not forked from this process: a thread still running nm here
+    # could leave a lock held in them for good.
+    context = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor, \
+            stats.phase('load'):
+        futures = [executor.submit(stats.run_counted, parse_chunk, chunk, *args)
+                   for chunk in chunks]
+        for future in futures:
+            yield stats.merge_counted(future.result())
+
 
 def get_locations_table_through_nm(binary_file_name):
-    out = subprocess.check_output(['nm', '-l', binary_file_name], encoding='utf-8')
+    with stats.phase('nm'):
+        out = subprocess.check_output(['nm', '-l', binary_file_name], encoding='utf-8')
     symbols = re.findall('([0-9a-fA-F]{16,})\s+.\s+(\S+)\s+(\S+)\s*', out)
 
     if len(symbols) > 0:
         table = {}
         for sym in symbols:
             table[int(sym[0], 16)] = sym[2]
-        return table
\ No newline at end of file
+        return table
+
+
+def demangle(names):
+    # Demangle C++ names with a single c++filt run. Names are returned as is
+    # when c++filt is not available.
+    if shutil.which('c++filt') is None or len(names) == 0:
+        return list(names)
+    with stats.phase('demangle'):
+        out = subprocess.run(['c++filt'], input='\n'.join(names) + '\n',
+                             stdout=subprocess.PIPE, encoding='utf-8', check=True).stdout
+    demangled = out.split('\n')[:len(names)]
+    if len(demangled) != len(names):
+        return list(names)
+    return demangled
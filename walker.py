@@ -0,0 +1,120 @@
+import itertools
+import sys
+
+# Prints caller trees in the format shared by callgraph.py and trace.py:
+#
+#   leaf 0x1139
+#     ├── mid 0x1147
+#     │   └── main 0x11c5
+#     └── other 0x1232 ...
+#
+# The walk keeps an explicit stack instead of recursing, so deep trees do
+# not run into the interpreter's recursion limit. Both front ends query
+# their graphs through print_callstacks().
+
+BRANCH = '├──'
+LAST_BRANCH = '└──'
+CONTINUED = '│   '
+BLANK = '    '
+
+
+class LineWriter:
+    # Collects output lines and writes them in batches.
+    def __init__(self, out=None, batch=1024):
+        self.out = out or sys.stdout
+        self.batch = batch
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.out.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+        self.out.flush()
+
+
+def print_callers(root, depth, describe, mark, writer, back_references=False,
+                  describe_edge=None):
+    # describe(fcn) returns the text shown for a function, and mark(kind,
+    # text) decorates the 'more', 'recursive' and 'reference' annotations.
+    # describe_edge(caller, callee), if given, returns text shown after each
+    # caller, such as where the call was found.
+    #
+    # With back_references each caller subtree is printed once. A function
+    # that was already expanded with at least as much depth left is shown
+    # as "see #N", where #N labels the earlier expansion.
+    on_path = set()
+    expanded = {}
+    # Labels of expansions; a function expanded again gets a new one.
+    labels = itertools.count(1)
+    # Prefix pieces of the ancestors below the root.
+    parts = []
+    # [function, index of the next caller to visit]
+    stack = []
+
+    def enter(fcn, is_last):
+        level = len(stack)
+        prefix = ''
+        if level > 0:
+            prefix = '  ' + ''.join(parts) + (LAST_BRANCH if is_last else BRANCH)
+
+        desc = describe(fcn)
+        if describe_edge is not None and level > 0:
+            desc += ' ' + describe_edge(fcn, stack[-1][0])
+        if level == depth and len(fcn.callers) > 0:
+            desc += ' ' + mark('more', '...')
+        recursive = id(fcn) in on_path
+        if recursive:
+            desc += ' ' + mark('recursive', ' possible recursive call ')
+        expand = level != depth and not recursive
+
+        if expand and back_references and len(fcn.callers) > 0:
+            if id(fcn) in expanded and expanded[id(fcn)][1] >= depth - level:
+                desc += ' ' + mark('reference', 'see #%d' % expanded[id(fcn)][0])
+                expand = False
+            else:
+                expanded[id(fcn)] = (next(labels), depth - level)
+                desc += ' ' + mark('reference', '#%d' % expanded[id(fcn)][0])
+
+        writer.write('%s %s' % (prefix, desc))
+        if not expand:
+            return
+        if level > 0:
+            parts.append(BLANK if is_last else CONTINUED)
+        on_path.add(id(fcn))
+        stack.append([fcn, 0])
+
+    enter(root, True)
+    while stack:
+        frame = stack[-1]
+        (fcn, idx) = frame
+        if idx == len(fcn.callers):
+            stack.pop()
+            on_path.discard(id(fcn))
+            if stack:
+                parts.pop()
+            continue
+        frame[1] += 1
+        enter(fcn.callers[idx], idx == len(fcn.callers) - 1)
+
+
+def print_callstacks(lookup, name, depth, describe, mark, writer, back_references=False,
+                     find_names=None, describe_edge=None):
+    # Prints the caller trees of the functions lookup(name) returns. When
+    # there are none, find_names(name), if given, returns the names to print
+    # instead.
+    fcns = lookup(name)
+    if fcns:
+        for fcn in fcns:
+            print_callers(fcn, depth, describe, mark, writer, back_references, describe_edge)
+    elif find_names is None:
+        writer.write('Function %s not found' % name)
+    else:
+        writer.write('Function %s not found. Displaying possible matches.' % name)
+        for match in find_names(name):
+            print_callstacks(lookup, match, depth, describe, mark, writer, back_references,
+                             find_names, describe_edge)
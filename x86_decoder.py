@@ -0,0 +1,239 @@
+# A minimal x86-64 instruction length decoder. It decodes just enough of
+# each instruction to step over it and to report direct call/jmp targets and
+# RIP-relative memory operands.
+
+LEGACY_PREFIXES = frozenset([0x66, 0x67, 0xf0, 0xf2, 0xf3,
+                             0x26, 0x2e, 0x36, 0x3e, 0x64, 0x65])
+
+# Kinds of references reported by decode_instruction.
+CALL = 'call'
+JMP = 'jmp'
+LEA = 'lea'
+RIP = 'rip'
+
+# Immediate sizes. IMMZ is 2 bytes with an operand size prefix, 4 otherwise.
+NONE, IMM8, IMM16, IMMZ, IMM16_8, REL8, REL32, MOFFS, IMMV = range(9)
+
+
+def build_one_byte_tables():
+    modrm = [False] * 256
+    imm = [NONE] * 256
+    for base in range(0x00, 0x40, 8):
+        for op in range(base, base + 4):
+            modrm[op] = True
+        imm[base + 4] = IMM8
+        imm[base + 5] = IMMZ
+    for op in [0x62, 0x63, 0x69, 0x6b, 0xc0, 0xc1, 0xc4, 0xc5, 0xc6, 0xc7,
+               0xd0, 0xd1, 0xd2, 0xd3, 0xf6, 0xf7, 0xfe, 0xff]:
+        modrm[op] = True
+    for op in range(0x80, 0x90):
+        modrm[op] = True
+    for op in range(0xd8, 0xe0):
+        modrm[op] = True
+    for op in [0x6a, 0x6b, 0x80, 0x82, 0x83, 0xa8, 0xc0, 0xc1, 0xc6, 0xcd,
+               0xe4, 0xe5, 0xe6, 0xe7]:
+        imm[op] = IMM8
+    for op in range(0xb0, 0xb8):
+        imm[op] = IMM8
+    for op in [0x68, 0x69, 0x81, 0xa9, 0xc7]:
+        imm[op] = IMMZ
+    for op in range(0xb8, 0xc0):
+        imm[op] = IMMV
+    for op in range(0x70, 0x80):
+        imm[op] = REL8
+    for op in [0xe0, 0xe1, 0xe2, 0xe3, 0xeb]:
+        imm[op] = REL8
+    for op in [0xe8, 0xe9]:
+        imm[op] = REL32
+    for op in range(0xa0, 0xa4):
+        imm[op] = MOFFS
+    imm[0xc2] = IMM16
+    imm[0xca] = IMM16
+    imm[0xc8] = IMM16_8
+    return (modrm, imm)
+
+
+def build_two_byte_tables():
+    modrm = [True] * 256
+    imm = [NONE] * 256
+    for op in [0x05, 0x06, 0x07, 0x08, 0x09, 0x0b, 0x0e, 0x77, 0xa0, 0xa1,
+               0xa2, 0xa8, 0xa9, 0xaa]:
+        modrm[op] = False
+    for op in range(0x30, 0x38):
+        modrm[op] = False
+    for op in range(0x80, 0x90):
+        modrm[op] = False
+        imm[op] = REL32
+    for op in range(0xc8, 0xd0):
+        modrm[op] = False
+    for op in [0x0f, 0x70, 0x71, 0x72, 0x73, 0xa4, 0xac, 0xba, 0xc2, 0xc4,
+               0xc5, 0xc6]:
+        imm[op] = IMM8
+    return (modrm, imm)
+
+
+ONE_BYTE_MODRM, ONE_BYTE_IMM = build_one_byte_tables()
+TWO_BYTE_MODRM, TWO_BYTE_IMM = build_two_byte_tables()
+
+
+def modrm_length(code, pos):
+    # Length of the ModRM byte and any SIB/displacement that follows it, and
+    # whether the operand is RIP-relative.
+    modrm = code[pos]
+    mod = modrm >> 6
+    rm = modrm & 7
+    if mod == 3:
+        return (1, False)
+    length = 1
+    if rm == 4:
+        sib = code[pos + 1]
+        length += 1
+        if mod == 0 and sib & 7 == 5:
+            return (length + 4, False)
+    elif mod == 0 and rm == 5:
+        return (length + 4, True)
+    if mod == 1:
+        return (length + 1, False)
+    if mod == 2:
+        return (length + 4, False)
+    return (length, False)
+
+
+def immediate_length(kind, opsize16, addrsize32, rexw):
+    if kind == NONE:
+        return 0
+    if kind == IMM8 or kind == REL8:
+        return 1
+    if kind == IMM16:
+        return 2
+    if kind == IMM16_8:
+        return 3
+    if kind == IMMZ:
+        return 2 if opsize16 else 4
+    if kind == REL32:
+        return 4
+    if kind == MOFFS:
+        return 4 if addrsize32 else 8
+    if kind == IMMV:
+        return 8 if rexw else (2 if opsize16 else 4)
+    return 0
+
+
+def signed32(code, pos):
+    return int.from_bytes(code[pos:pos + 4], 'little', signed=True)
+
+
+def decode_instruction(code, pos):
+    # Returns (length, kind, field, target) for the instruction at pos.
+    # kind is CALL/JMP for direct rel32 branches, LEA/RIP for RIP-relative
+    # memory operands and None otherwise. field is the offset of the rel32
+    # or disp32 within the instruction and target is the value relative to
+    # the end of the instruction. Raises IndexError on truncated input.
+    start = pos
+    opsize16 = False
+    addrsize32 = False
+    rexw = False
+    while code[pos] in LEGACY_PREFIXES:
+        if code[pos] == 0x66:
+            opsize16 = True
+        elif code[pos] == 0x67:
+            addrsize32 = True
+        pos += 1
+    if 0x40 <= code[pos] <= 0x4f:
+        rexw = bool(code[pos] & 8)
+        pos += 1
+
+    op = code[pos]
+    pos += 1
+    has_modrm = False
+    imm = NONE
+    one_byte = False
+
+    if op == 0xc4 or op == 0xc5 or op == 0x62:
+        # VEX and EVEX. The map selects the opcode table.
+        if op == 0xc5:
+            table_map = 1
+            pos += 1
+        elif op == 0xc4:
+            table_map = code[pos] & 0x1f
+            pos += 2
+        else:
+            table_map = code[pos] & 0x7
+            pos += 3
+        op = code[pos]
+        pos += 1
+        has_modrm = not (table_map == 1 and op == 0x77)
+        if table_map == 3:
+            imm = IMM8
+        elif table_map == 1 and TWO_BYTE_IMM[op] == IMM8:
+            imm = IMM8
+    elif op == 0x8f and (code[pos] >> 3) & 7 != 0:
+        # AMD XOP.
+        table_map = code[pos] & 0x1f
+        pos += 2
+        pos += 1
+        has_modrm = True
+        if table_map == 8:
+            imm = IMM8
+        elif table_map == 0xa:
+            imm = IMMZ
+    elif op == 0x0f:
+        op = code[pos]
+        pos += 1
+        if op == 0x38:
+            pos += 1
+            has_modrm = True
+        elif op == 0x3a:
+            pos += 1
+            has_modrm = True
+            imm = IMM8
+        else:
+            has_modrm = TWO_BYTE_MODRM[op]
+            # 3DNow! (0f 0f) has a trailing opcode byte, read as an imm8.
+            imm = TWO_BYTE_IMM[op]
+    else:
+        one_byte = True
+        has_modrm = ONE_BYTE_MODRM[op]
+        imm = ONE_BYTE_IMM[op]
+        if (op == 0xf6 or op == 0xf7) and (code[pos] >> 3) & 7 in (0, 1):
+            imm = IMM8 if op == 0xf6 else IMMZ
+
+    rip_relative = False
+    field = None
+    if has_modrm:
+        (length, rip_relative) = modrm_length(code, pos)
+        if rip_relative:
+            field = pos + length - 4 - start
+        pos += length
+
+    immlen = immediate_length(imm, opsize16, addrsize32, rexw)
+    kind = None
+    if imm == REL32 and one_byte:
+        kind = CALL if op == 0xe8 else JMP
+        field = pos - start
+    elif rip_relative:
+        kind = LEA if one_byte and op == 0x8d else RIP
+    pos += immlen
+    if pos > len(code):
+        raise IndexError('truncated instruction')
+
+    length = pos - start
+    target = None
+    if kind is not None:
+        target = signed32(code, start + field)
+    return (length, kind, field, target)
+
+
+def decode_references(code, address):
+    # Yields (kind, target address) for every direct call/jmp and
+    # RIP-relative operand in code, which is located at address.
+    pos = 0
+    end = len(code)
+    while pos < end:
+        try:
+            (length, kind, field, target) = decode_instruction(code, pos)
+        except IndexError:
+            return
+        pos += length
+        if kind is not None:
+            yield (kind, address + pos + target)